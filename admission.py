@@ -0,0 +1,97 @@
+import asyncio
+import math
+import time
+
+import metrics
+
+# =========================================================
+# ADMISSION CONTROL (forecasts computed inside a request)
+# A burst of cold forecast requests would otherwise start a Prophet fit each,
+# tie up every worker thread, and push every endpoint into timeouts. Here:
+# - identical requests in flight share ONE computation
+# - at most `limit` computations run at once
+# - at most `max_queue` more wait for a slot, none longer than `timeout` seconds
+# Anything beyond that is turned away straight away with a retry hint, so the
+# worker stays responsive. Like jobs.py, it all runs on the event loop: no locks.
+# =========================================================
+
+
+class Overloaded(Exception):
+    """Not admitted. status_code: 429 (queue full) or 503 (waited too long); retry_after in seconds."""
+
+    def __init__(self, status_code, retry_after, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """
+    run(key, work) awaits work() under the limits above. Callers with the same key
+    while it's queued or running get the same result (or the same Overloaded).
+    """
+
+    def __init__(self, name, limit, max_queue, timeout):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(limit)
+        self._inflight = {}  # key -> asyncio.Task
+        self._running = 0
+        self._queued = 0
+        # Recent seconds per computation (moving average), for Retry-After
+        self._duration = timeout
+
+    async def run(self, key, work):
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.get_running_loop().create_task(self._admit(work))
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            metrics.inc("cacao_admission_total", pool=self.name, result="shared")
+        # Shielded: one caller going away must not cancel the others' computation
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Retrieved even if every caller went away (no "never retrieved" warning)
+
+    def retry_after(self):
+        """Seconds until the work ahead of a newcomer has likely drained (at least 1)."""
+        return max(1, math.ceil(self._duration * (self._queued + self._running) / self.limit))
+
+    async def _admit(self, work):
+        if self._slots.locked():
+            if self._queued >= self.max_queue:
+                metrics.inc("cacao_admission_total", pool=self.name, result="rejected")
+                raise Overloaded(429, self.retry_after(), f"Too many {self.name} forecasts queued, retry later")
+            self._queued += 1
+            self._publish()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                metrics.inc("cacao_admission_total", pool=self.name, result="timed_out")
+                raise Overloaded(503, self.retry_after(),
+                                 f"No {self.name} forecast slot freed up within {self.timeout:g}s, retry later")
+            finally:
+                self._queued -= 1
+        else:
+            await self._slots.acquire()
+
+        metrics.inc("cacao_admission_total", pool=self.name, result="admitted")
+        self._running += 1
+        self._publish()
+        started = time.perf_counter()
+        try:
+            return await work()
+        finally:
+            self._duration = 0.8 * self._duration + 0.2 * (time.perf_counter() - started)
+            self._running -= 1
+            self._slots.release()
+            self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("cacao_admission_requests", self._running, pool=self.name, state="running")
+        metrics.set_gauge("cacao_admission_requests", self._queued, pool=self.name, state="queued")
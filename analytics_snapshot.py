@@ -0,0 +1,343 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import cache
+
+from sqlalchemy import text
+
+import db
+
+# =========================================================
+# ANALYTICS SNAPSHOT (Parquet on local disk)
+# Forecast training and a full rescoring read whole tables of history, which is
+# the heaviest read load the API puts on Postgres. This exports transactions,
+# production_logs and suppliers to Parquet files (one directory per month),
+# appending only the rows past the previous export, and those reads then go
+# through DuckDB (or memory-mapped Arrow) instead of the database.
+#
+#   python analytics_snapshot.py               # export what's new (cron: every few minutes)
+#   python analytics_snapshot.py --full        # rebuild from scratch
+#   python analytics_snapshot.py --every 300   # keep exporting
+#
+# Reads only use it with ANALYTICS_SNAPSHOT=1, and only while it's fresh: it must
+# hold exactly the data the live fingerprint (row count, newest date, total kg)
+# describes or, with ANALYTICS_SNAPSHOT_MAX_LAG, be younger than that many seconds.
+# Otherwise (or without duckdb/pyarrow installed) they query Postgres as before.
+# =========================================================
+
+ENABLED = os.getenv('ANALYTICS_SNAPSHOT', '0') == '1'
+SNAPSHOT_DIR = os.getenv('ANALYTICS_SNAPSHOT_DIR', '.analytics_snapshot')
+# Seconds an export is trusted without comparing it to the database (0 = always compare)
+MAX_LAG = float(os.getenv('ANALYTICS_SNAPSHOT_MAX_LAG', '0'))
+# Rows fetched (and written) at a time, so the first export doesn't hold a whole table in memory
+EXPORT_CHUNK_ROWS = 200_000
+# Appends add a file per month they touch; past this many, a month is merged back into one
+MAX_PARTS_PER_MONTH = 8
+
+# Event tables: the id that orders rows with the same date, the kg column
+# (part of the fingerprint), what's exported and the types it's written as (a
+# chunk where a column is all NULL must not change the files' schema)
+EVENT_TABLES = {
+    "transactions": {
+        "id": "transaction_id",
+        "kg": "amount",
+        # The typed quality columns, not the JSONB they're generated from
+        "columns": "transaction_id, supplier_id, date, amount, price::float8 AS price, status, "
+                   "moldy_percent, insect_damaged_percent, moisture_content",
+        "dtypes": {"amount": "int64", "price": "float64", "moldy_percent": "float64",
+                   "insect_damaged_percent": "float64", "moisture_content": "float64"},
+    },
+    "production_logs": {
+        "id": "log_id",
+        "kg": "quantity",
+        "columns": "log_id, date, product_type, quantity, supplier_id",
+        "dtypes": {"quantity": "int64"},
+    },
+}
+# reliability_score changes on every scoring run, so it's always read live
+SUPPLIER_COLUMNS = "supplier_id, name, location, bearing_trees, philgap_certified"
+SUPPLIER_DTYPES = {"bearing_trees": "float64", "philgap_certified": "boolean"}
+
+# One export at a time; a second one started meanwhile just skips
+LOCK_QUERY = "SELECT pg_try_advisory_xact_lock(hashtext('analytics_snapshot'))"
+
+_manifest = {"key": None, "data": {}}
+_manifest_lock = threading.Lock()
+
+
+def fingerprint_query(table):
+    return f"SELECT COUNT(*), MAX(date), COALESCE(SUM({EVENT_TABLES[table]['kg']}), 0) FROM {table}"
+
+
+def as_fingerprint(count, max_date, total):
+    """Same shape as forecasting.fingerprint, so a live fingerprint and the snapshot's compare equal."""
+    return {"count": int(count), "max_date": str(max_date), "sum": float(total)}
+
+
+@cache
+def reader():
+    """'duckdb', 'arrow' (only pyarrow installed) or None (neither: every read goes to Postgres)."""
+    try:
+        import duckdb  # noqa: F401
+        return "duckdb"
+    except ImportError:
+        pass
+    try:
+        import pyarrow  # noqa: F401
+        return "arrow"
+    except ImportError:
+        return None
+
+
+def _manifest_path():
+    return os.path.join(SNAPSHOT_DIR, "manifest.json")
+
+
+def load_manifest():
+    """{table: entry} of the last export ({} before the first one), re-read only when the file changed."""
+    try:
+        mtime = os.stat(_manifest_path()).st_mtime_ns
+    except OSError:
+        return {}
+    with _manifest_lock:
+        if _manifest["key"] != (SNAPSHOT_DIR, mtime):
+            try:
+                with open(_manifest_path()) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return {}
+            _manifest.update(key=(SNAPSHOT_DIR, mtime), data=data)
+        return _manifest["data"]
+
+
+def current(table, live_fingerprint=None, manifest=None):
+    """
+    The snapshot's entry for `table` if reads should use it, else None (query Postgres):
+    - with live_fingerprint: the snapshot must hold exactly that data
+    - without: it must be younger than MAX_LAG seconds (never, by default)
+    """
+    if not ENABLED or reader() is None:
+        return None
+    entry = (load_manifest() if manifest is None else manifest).get(table)
+    if entry is None:
+        return None
+    if live_fingerprint is not None:
+        return entry if entry["fingerprint"] == live_fingerprint else None
+    return entry if time.time() - entry["as_of"] < MAX_LAG else None
+
+
+def _paths(entry):
+    return [os.path.join(SNAPSHOT_DIR, part["path"]) for part in entry["parts"]]
+
+
+def _sql_list(paths):
+    return "[" + ", ".join("'" + path.replace("'", "''") + "'" for path in paths) + "]"
+
+
+def _duckdb_df(query):
+    import duckdb
+
+    # A connection per read: they're cheap, and reads come from several threads
+    con = duckdb.connect()
+    try:
+        return con.execute(query).df()
+    finally:
+        con.close()
+
+
+def read_columns(entry, columns):
+    """`columns` of every row in the snapshot's files, as one DataFrame."""
+    import pandas as pd
+
+    paths = _paths(entry)
+    if not paths:
+        return pd.DataFrame(columns=list(columns))
+    if reader() == "duckdb":
+        return _duckdb_df(f"SELECT {', '.join(columns)} FROM read_parquet({_sql_list(paths)})")
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    return pa.concat_tables([pq.read_table(path, columns=list(columns), memory_map=True) for path in paths]).to_pandas()
+
+
+def daily_totals(entry, column):
+    """
+    (ds, y): `column` summed per calendar day, days without events as 0 (what
+    forecasting.daily_series_query returns). DuckDB sums straight off the files;
+    the Arrow fallback maps the two columns and sums them in pandas.
+    """
+    import pandas as pd
+
+    if not entry["parts"]:
+        return pd.DataFrame({"ds": pd.to_datetime([]), "y": []})
+    if reader() == "duckdb":
+        daily = _duckdb_df(f"""
+            SELECT date_trunc('day', CAST(date AS TIMESTAMP)) AS ds, SUM({column}) AS y
+            FROM read_parquet({_sql_list(_paths(entry))})
+            GROUP BY 1
+        """)
+    else:
+        rows = read_columns(entry, ["date", column])
+        daily = rows.groupby(rows["date"].dt.floor("D"))[column].sum().rename_axis("ds").reset_index(name="y")
+    return daily.set_index("ds").sort_index().asfreq("D", fill_value=0).reset_index()
+
+
+# ---------------------------------------------------------
+# EXPORT
+# ---------------------------------------------------------
+def _write_part(entry, table, month, df):
+    path = os.path.join(f"{table}-{entry['generation']}", f"month={month}", f"part-{entry['next_part']:05d}.parquet")
+    os.makedirs(os.path.dirname(os.path.join(SNAPSHOT_DIR, path)), exist_ok=True)
+    df.to_parquet(os.path.join(SNAPSHOT_DIR, path), index=False)
+    entry["next_part"] += 1
+    return {"month": month, "path": path, "rows": len(df)}
+
+
+def _compact(entry, table):
+    """Merges the months that piled up more than MAX_PARTS_PER_MONTH files into one file each."""
+    import pandas as pd
+
+    by_month = {}
+    for part in entry["parts"]:
+        by_month.setdefault(part["month"], []).append(part)
+    for month, parts in by_month.items():
+        if len(parts) <= MAX_PARTS_PER_MONTH:
+            continue
+        merged = pd.concat([pd.read_parquet(os.path.join(SNAPSHOT_DIR, p["path"])) for p in parts], ignore_index=True)
+        entry["parts"] = [p for p in entry["parts"] if p["month"] != month]
+        entry["parts"].append(_write_part(entry, table, month, merged))
+
+
+def _export_events(conn, table, entry):
+    """
+    Appends the rows past `entry`'s watermark. If the rows already exported no longer
+    add up to the live totals (deleted, changed or back-dated since), re-exports the
+    table into a new generation instead. Returns (entry, rows written).
+    """
+    import pandas as pd
+
+    spec = EVENT_TABLES[table]
+    live = as_fingerprint(*conn.execute(text(fingerprint_query(table))).one())
+    if entry and entry["fingerprint"] == live:
+        return {**entry, "as_of": time.time()}, 0
+
+    query, params = f"SELECT {spec['columns']} FROM {table}", {}
+    if entry and entry["watermark"]:
+        params = {"date": datetime.fromisoformat(entry["watermark"]["date"]), "id": entry["watermark"]["id"]}
+        # The plain date bound lets Postgres skip old months of a partitioned table
+        query += f" WHERE date >= :date AND (date, {spec['id']}) > (:date, :id)"
+        count, total = conn.execute(text(f"SELECT COUNT(*), COALESCE(SUM({spec['kg']}), 0) FROM ({query}) new"),
+                                    params).one()
+        if (entry["fingerprint"]["count"] + count, entry["fingerprint"]["sum"] + float(total)) != \
+                (live["count"], live["sum"]):
+            entry = None
+    else:
+        entry = None  # First export, or the table was empty last time
+    if entry is None:
+        query, params = f"SELECT {spec['columns']} FROM {table}", {}
+        entry = {"generation": uuid.uuid4().hex[:12], "parts": [], "next_part": 0, "watermark": None}
+
+    written = 0
+    for chunk in pd.read_sql(text(f"{query} ORDER BY date, {spec['id']}"), conn, params=params,
+                             chunksize=EXPORT_CHUNK_ROWS, dtype=spec["dtypes"]):
+        if chunk.empty:
+            continue
+        for month, rows in chunk.groupby(chunk["date"].dt.strftime("%Y-%m"), sort=True):
+            entry["parts"].append(_write_part(entry, table, month, rows))
+        # The query is ordered, so the last row is the new high-water mark
+        newest = chunk.iloc[-1]
+        entry["watermark"] = {"date": newest["date"].isoformat(), "id": newest[spec["id"]]}
+        written += len(chunk)
+    _compact(entry, table)
+    entry.update(fingerprint=live, as_of=time.time())
+    return entry, written
+
+
+def _export_suppliers(conn):
+    """Rewritten every time: one small file, and scores/profiles change in place."""
+    import pandas as pd
+
+    suppliers = pd.read_sql(text(f"SELECT {SUPPLIER_COLUMNS} FROM suppliers ORDER BY supplier_id"), conn,
+                            dtype=SUPPLIER_DTYPES)
+    path = f"suppliers-{uuid.uuid4().hex[:12]}.parquet"
+    suppliers.to_parquet(os.path.join(SNAPSHOT_DIR, path), index=False)
+    entry = {"parts": [{"path": path, "rows": len(suppliers)}], "fingerprint": {"count": len(suppliers)},
+             "as_of": time.time()}
+    return entry, len(suppliers)
+
+
+def _write_manifest(manifest):
+    tmp_path = f"{_manifest_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, _manifest_path())
+
+
+def _remove_unreferenced(manifest):
+    """Deletes files no table points at any more (replaced generations, merged parts, crashed runs)."""
+    keep = {os.path.normpath(path) for path in
+            (os.path.join(SNAPSHOT_DIR, part["path"]) for entry in manifest.values() for part in entry["parts"])}
+    keep.add(os.path.normpath(_manifest_path()))
+    for root, dirs, files in os.walk(SNAPSHOT_DIR, topdown=False):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if path not in keep:
+                os.remove(path)
+        if root != SNAPSHOT_DIR and not os.listdir(root):
+            os.rmdir(root)
+
+
+def export(full=False):
+    """
+    Brings the snapshot up to date from one consistent view of the database, so the
+    three tables agree with each other. Returns {table: rows written}, or None when
+    another export is already running.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    written = {}
+    with db.get_engine().connect() as conn:
+        conn.execution_options(isolation_level="REPEATABLE READ", stream_results=True)
+        with conn.begin():
+            if not conn.execute(text(LOCK_QUERY)).scalar():
+                return None
+            manifest = {} if full else copy.deepcopy(load_manifest())
+            for table in EVENT_TABLES:
+                manifest[table], written[table] = _export_events(conn, table, manifest.get(table))
+            manifest["suppliers"], written["suppliers"] = _export_suppliers(conn)
+            # Both before the lock is released: the next export starts from this manifest,
+            # and must not find its own new files swept away. Readers that loaded the
+            # previous manifest may still be on the removed files; they fall back to Postgres.
+            _write_manifest(manifest)
+            _remove_unreferenced(manifest)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export transactions/production_logs/suppliers to Parquet.")
+    parser.add_argument("--full", action="store_true", help="Rebuild the snapshot from scratch")
+    parser.add_argument("--every", type=float, help="Keep exporting, every this many seconds")
+    args = parser.parse_args()
+
+    try:
+        import pyarrow  # noqa: F401  (pandas writes Parquet through it)
+    except ImportError:
+        sys.exit("❌ pyarrow is required to export (pip install pyarrow duckdb).")
+
+    while True:
+        started = time.perf_counter()
+        result = export(full=args.full)
+        if result is None:
+            print("⚠️ Another export is running; skipped.")
+        else:
+            summary = ", ".join(f"{table} {rows:,}" for table, rows in result.items())
+            print(f"✅ Snapshot up to date in {time.perf_counter() - started:.1f}s (rows written: {summary}).")
+        if not args.every:
+            break
+        args.full = False
+        time.sleep(args.every)
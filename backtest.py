@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from dotenv import load_dotenv
+
+import db
+import forecasting
+
+# =========================================================
+# FORECAST BACKTESTS (rolling origin)
+# For every forecaster the API can use, repeatedly: train on the history up to
+# a cutoff, predict the next `horizon` days, compare with what really happened,
+# move the cutoff `step` days on. Folds run in parallel on every core, and each
+# fold's result is cached by a hash of its data, so a rerun only fits the folds
+# that new data added.
+#
+#   python backtest.py --horizon 30 --step 14 --initial 90
+#
+# - MAPE: error of the horizon TOTAL (what the endpoints report), in %
+# - MAE: mean absolute error of the daily kg
+# - fit: seconds to fit + predict one model
+# =========================================================
+load_dotenv();
+
+# Exactly what the endpoints run (see forecasting.SERIES)
+MODELS = {
+    "prophet_demand": ("prophet", forecasting.SERIES["demand"]["prophet"]),        # /predict-demand
+    "prophet_flows": ("prophet", forecasting.SERIES["supply"]["prophet"]),          # /suggest-orders-smart
+    "holt_winters": ("holt_winters", {}),                                           # ?mode=fast
+}
+# The distinct training series (demand and supply are both trained on transactions)
+DATASETS = {
+    "transactions": forecasting.SERIES["supply"]["query"],
+    "production_logs": forecasting.SERIES["outflow"]["query"],
+}
+
+CACHE_DIR = os.getenv('BACKTEST_CACHE_DIR', '.backtest_cache')
+
+
+def fold_key(model, horizon, train, actual):
+    kind, params = MODELS[model]
+    digest = hashlib.sha1(json.dumps({"kind": kind, "params": params, "horizon": horizon}, sort_keys=True).encode())
+    digest.update(str(train["ds"].iloc[0]).encode())
+    digest.update(train["y"].to_numpy(dtype=float).tobytes())
+    digest.update(np.asarray(actual, dtype=float).tobytes())
+    return f"{model}-{digest.hexdigest()[:20]}"
+
+
+def run_fold(model, train, actual):
+    """
+    Runs in a pool worker: fit on `train`, forecast len(actual) days, score it.
+    Returns {"mae", "ape" (None when nothing happened in the window), "fit_seconds"}.
+    """
+    kind, params = MODELS[model]
+    horizon = len(actual)
+    if kind == "prophet":
+        _, forecast, timings = forecasting.fit_and_forecast(train, params, horizon)
+    else:
+        _, forecast, timings = forecasting.fast_forecast(train, horizon)
+
+    predicted = np.asarray(forecast["daily"])
+    actual = np.asarray(actual, dtype=float)
+    actual_total = actual.sum()
+    return {
+        "mae": float(np.abs(predicted - actual).mean()),
+        "ape": float(abs(predicted.sum() - actual_total) / actual_total) if actual_total else None,
+        "fit_seconds": float(sum(timings.values())),
+    }
+
+
+def folds(df, horizon, step, initial):
+    """(cutoff date, train df, actual daily values) per fold. Cutoffs count from the
+    start of the data, so new days only add folds at the end (older ones stay cached)."""
+    for cutoff in range(initial, len(df) - horizon + 1, step):
+        yield df["ds"].iloc[cutoff], df.iloc[:cutoff], df["y"].iloc[cutoff:cutoff + horizon].to_numpy(dtype=float)
+
+
+def summarize(results):
+    apes = [r["ape"] for r in results if r["ape"] is not None]
+    fits = np.array([r["fit_seconds"] for r in results])
+    return {
+        "folds": len(results),
+        "mape_pct": round(100 * float(np.mean(apes)), 2) if apes else None,
+        "mae_kg": round(float(np.mean([r["mae"] for r in results])), 1),
+        "fit_mean_s": round(float(fits.mean()), 3),
+        "fit_p95_s": round(float(np.percentile(fits, 95)), 3),
+    }
+
+
+def backtest(models, datasets, horizon=30, step=14, initial=90, workers=None, cache_dir=CACHE_DIR):
+    """
+    Returns {dataset: {model: summary}} (see summarize), plus how many folds were
+    fitted vs. answered from the cache.
+    """
+    import pandas as pd  # Slow to import; only needed here
+
+    os.makedirs(cache_dir, exist_ok=True)
+    engine = db.get_engine()
+    results = {dataset: {model: [] for model in models} for dataset in datasets}
+    pending = []
+    for dataset in datasets:
+        df = pd.read_sql(DATASETS[dataset], engine)
+        for cutoff, train, actual in folds(df, horizon, step, initial):
+            for model in models:
+                key = fold_key(model, horizon, train, actual)
+                path = os.path.join(cache_dir, f"{key}.json")
+                if os.path.exists(path):
+                    with open(path) as f:
+                        results[dataset][model].append(json.load(f))
+                else:
+                    pending.append((dataset, model, str(cutoff.date()), path, train, actual))
+
+    cached = sum(len(r) for by_model in results.values() for r in by_model.values())
+    print(f"🔁 {cached} folds cached, {len(pending)} to fit on {workers or os.cpu_count()} processes...")
+    started = time.perf_counter()
+    if pending:
+        # 'spawn' for the same reason as the API's fit pool (see forecasting.get_fit_pool)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=forecasting.warm_up_worker) as pool:
+            jobs = {pool.submit(run_fold, model, train, actual): (dataset, model, cutoff, path)
+                    for dataset, model, cutoff, path, train, actual in pending}
+            for done, job in enumerate(as_completed(jobs), 1):
+                dataset, model, cutoff, path = jobs[job]
+                result = {"cutoff": cutoff, **job.result()}
+                with open(path, "w") as f:
+                    json.dump(result, f)
+                results[dataset][model].append(result)
+                print(f"\r   {done}/{len(pending)} folds fitted", end="", flush=True)
+        print()
+
+    summaries = {
+        dataset: {model: summarize(r) for model, r in by_model.items() if r}
+        for dataset, by_model in results.items()
+    }
+    return {"fitted": len(pending), "cached": cached, "seconds": round(time.perf_counter() - started, 1),
+            "results": summaries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the forecasters.")
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--datasets", nargs="+", choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument("--horizon", type=int, default=30, help="Days predicted per fold")
+    parser.add_argument("--step", type=int, default=14, help="Days between fold cutoffs")
+    parser.add_argument("--initial", type=int, default=90, help="Days of history before the first cutoff")
+    parser.add_argument("--workers", type=int, help="Fit processes (default: one per core)")
+    parser.add_argument("--output", default="backtest_results.json")
+    args = parser.parse_args()
+
+    report = backtest(args.models, args.datasets, args.horizon, args.step, args.initial, args.workers)
+    print(f"✅ {report['fitted']} folds fitted in {report['seconds']}s ({report['cached']} from cache)\n")
+    print(f"{'dataset':<16} {'model':<16} {'folds':>5} {'MAPE %':>8} {'MAE kg':>9} {'fit s':>7} {'fit p95':>8}")
+    for dataset, by_model in report["results"].items():
+        for model, s in by_model.items():
+            mape = f"{s['mape_pct']:.1f}" if s["mape_pct"] is not None else "-"
+            print(f"{dataset:<16} {model:<16} {s['folds']:>5} {mape:>8} {s['mae_kg']:>9.1f} "
+                  f"{s['fit_mean_s']:>7.3f} {s['fit_p95_s']:>8.3f}")
+
+    with open(args.output, "w") as f:
+        json.dump({"horizon": args.horizon, "step": args.step, "initial": args.initial, **report}, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import make_url
+
+# =========================================================
+# END-TO-END BENCHMARKS
+# Loads synthetic datasets into a LOCAL, throwaway database and times the
+# scoring engine, the stock query, the forecasters and the API endpoints.
+#
+#   BENCH_DATABASE_URL='postgresql://postgres@localhost/cacao_bench' \
+#       python benchmark.py --scales small medium --baseline bench_baseline.json
+#
+# ⚠️ Every scale WIPES the target database (schema is re-created).
+# =========================================================
+load_dotenv();
+
+SCALES = {
+    "small": {"suppliers": 10, "events": 10_000},
+    "medium": {"suppliers": 1_000, "events": 1_000_000},
+    "large": {"suppliers": 10_000, "events": 10_000_000},
+}
+HISTORY_YEARS = 2
+DELIVERY_SHARE = 0.3  # Share of events that are deliveries (the rest are cooking batches)
+IMPORT_BUDGET_MS = 1000  # Cold `import main` (uvicorn worker boot / --reload)
+RSS_SAMPLE_INTERVAL = 0.01  # Seconds between memory samples while a target runs
+
+
+def is_local(url):
+    url = make_url(url)
+    socket_dir = str(url.query.get("host", ""))
+    return url.host in (None, "localhost", "127.0.0.1", "::1") or socket_dir.startswith("/")
+
+
+def process_tree_rss_mb():
+    """
+    Current RSS of this process plus its live descendants (the Prophet fit pool), in MB.
+    Read from /proc (Linux); None elsewhere.
+    """
+    parents = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # "pid (comm) state ppid ...": comm may contain spaces, so split after ")"
+                parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue  # Exited meanwhile
+
+    tree, queue = [], [os.getpid()]
+    while queue:
+        pid = queue.pop()
+        tree.append(pid)
+        queue.extend(child for child, parent in parents.items() if parent == pid)
+
+    total_kb = 0
+    for pid in tree:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1)
+
+
+@contextlib.contextmanager
+def sample_rss(peak):
+    """
+    Samples process_tree_rss_mb() on a thread while the block runs and raises
+    peak["mb"] to the highest value seen (a lifetime high-water mark such as
+    ru_maxrss would carry over from earlier targets, and misses live children).
+    """
+    stop = threading.Event()
+
+    def sample():
+        while True:
+            current = process_tree_rss_mb()
+            if current is not None:
+                peak["mb"] = max(peak.get("mb") or 0.0, current)
+            if stop.wait(RSS_SAMPLE_INTERVAL):
+                return
+
+    sampler = threading.Thread(target=sample, name="rss-sampler", daemon=True)
+    sampler.start()
+    try:
+        yield peak
+    finally:
+        stop.set()
+        sampler.join()
+        current = process_tree_rss_mb()  # The block's end state, however short it was
+        if current is not None:
+            peak["mb"] = max(peak.get("mb") or 0.0, current)
+
+
+def measure(fn, repeat, before=None):
+    """
+    Runs fn `repeat` times (before() is untimed setup). Returns latency stats in ms, plus
+    the peak RSS of this process + its children while fn ran, and how far that is
+    above where this target started.
+    """
+    timings = []
+    start_rss = process_tree_rss_mb()
+    peak = {"mb": None}
+    for _ in range(repeat):
+        if before:
+            before()
+        with contextlib.redirect_stdout(io.StringIO()), sample_rss(peak):  # The engines print a lot
+            started = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - started) * 1000)
+    timings = np.array(timings)
+    return {
+        "runs": repeat,
+        "p50_ms": round(float(np.percentile(timings, 50)), 2),
+        "p95_ms": round(float(np.percentile(timings, 95)), 2),
+        "max_ms": round(float(timings.max()), 2),
+        "peak_rss_mb": peak["mb"],
+        "rss_growth_mb": None if start_rss is None or peak["mb"] is None else round(peak["mb"] - start_rss, 1),
+    }
+
+
+def measure_import_time(module="main", repeat=3):
+    """
+    Cold import of `module` in fresh interpreters, via `python -X importtime`.
+    Returns {"module", "total_ms" (best of `repeat`), "slowest": {direct import: ms}}.
+    """
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+        # Lines are "import time: self | cumulative | name", children listed before their
+        # parent and indented 2 spaces per level
+        total_us, children = None, []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            if depth == 0:
+                if name.strip() == module:
+                    total_us = int(cumulative)
+                    break
+                children = []
+            elif depth == 1:
+                children.append((name.strip(), int(cumulative)))
+
+        if total_us is not None and (best is None or total_us < best[0]):
+            best = (total_us, children)
+
+    total_us, children = best
+    slowest = sorted(children, key=lambda child: -child[1])[:8]
+    return {
+        "module": module,
+        "total_ms": round(total_us / 1000, 1),
+        "slowest": {name: round(us / 1000, 1) for name, us in slowest},
+    }
+
+
+def load_dataset(scale):
+    import db
+    import seeder
+    import stock_ledger
+
+    spec = SCALES[scale]
+    days = HISTORY_YEARS * 365
+    with db.get_engine().begin() as conn:
+        conn.exec_driver_sql(open(os.path.join(os.path.dirname(__file__), "db_schema.sql")).read())
+    stock_ledger.install()
+    with contextlib.redirect_stdout(io.StringIO()):
+        seeder.generate_scaled_data(
+            suppliers=spec["suppliers"],
+            years=HISTORY_YEARS,
+            deliveries_per_day=spec["events"] * DELIVERY_SHARE / days,
+            batches_per_day=spec["events"] * (1 - DELIVERY_SHARE) / days,
+            seed=42,
+        )
+
+
+def run_scale(scale, repeat, skip_load):
+    from fastapi.testclient import TestClient
+
+    import forecasting
+    import main
+    import scoring_engine
+
+    if not skip_load:
+        started = time.perf_counter()
+        print(f"📦 [{scale}] Loading {SCALES[scale]['suppliers']:,} suppliers / {SCALES[scale]['events']:,} events...")
+        load_dataset(scale)
+        print(f"   loaded in {time.perf_counter() - started:.1f}s")
+
+    def cold_cache():
+        # In-memory only, empty: forces a real fit
+        forecasting.model_cache = forecasting.ModelCache(cache_dir=None)
+
+    def get_ok(client, path, method="get"):
+        response = getattr(client, method)(path)
+        body = response.json()
+        if response.status_code != 200 or body.get("status") == "error":
+            raise RuntimeError(f"{method.upper()} {path} failed: {body}")
+
+    results = {}
+    # A fresh lifespan per scale: its own pools and refresher (main.py creates them
+    # in lifespan, so running the app again in this process works)
+    with TestClient(main.app) as client:
+        # Warm this dataset's forecasts before timing (the refresher's own first pass runs in the background)
+        main.forecast_refresher.refresh_many([(name, 30, False, mode)
+                                              for name in forecasting.SERIES for mode in forecasting.MODES])
+
+        targets = [
+            ("calculate_scores (full)", lambda: scoring_engine.calculate_scores(full=True), None),
+            ("calculate_scores (incremental)", scoring_engine.calculate_scores, None),
+            ("get_current_warehouse_stock", lambda: client.portal.call(main.get_current_warehouse_stock), None),
+            ("forecast fit (accurate, cold)",
+             lambda: forecasting.forecast_totals(main.engine, ["supply", "outflow"], 30, "accurate"), cold_cache),
+            ("forecast fit (fast, cold)",
+             lambda: forecasting.forecast_totals(main.engine, ["supply", "outflow"], 30, "fast"), cold_cache),
+            ("GET /predict-demand", lambda: get_ok(client, "/predict-demand"), None),
+            ("GET /suggest-orders-smart", lambda: get_ok(client, "/suggest-orders-smart"), None),
+            ("GET /suggest-orders-smart?mode=fast", lambda: get_ok(client, "/suggest-orders-smart?mode=fast"), None),
+            ("POST /update-scores", lambda: get_ok(client, "/update-scores?wait=300", method="post"), None),
+        ]
+        for name, fn, before in targets:
+            results[name] = measure(fn, repeat, before)
+            print(f"   {name:<38} p50={results[name]['p50_ms']:>10.1f}ms "
+                  f"p95={results[name]['p95_ms']:>10.1f}ms max={results[name]['max_ms']:>10.1f}ms "
+                  f"rss={results[name]['peak_rss_mb']}MB (+{results[name]['rss_growth_mb']})")
+    return results
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """Returns the list of targets whose p50 got slower than baseline * (1 + tolerance) + slack."""
+    regressions = []
+    for scale, scale_result in results["scales"].items():
+        base_targets = baseline.get("scales", {}).get(scale, {}).get("targets", {})
+        for name, stats in scale_result["targets"].items():
+            if name not in base_targets:
+                continue
+            limit = base_targets[name]["p50_ms"] * (1 + tolerance) + slack_ms
+            if stats["p50_ms"] > limit:
+                regressions.append(f"[{scale}] {name}: p50 {stats['p50_ms']}ms > {limit:.1f}ms "
+                                   f"(baseline {base_targets[name]['p50_ms']}ms)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks (wipes the target database!)")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small"])
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per target")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Compare against this results file; exit 1 on regression")
+    parser.add_argument("--save-baseline", help="Also write the results to this file as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p50 slowdown (0.25 = 25%%)")
+    parser.add_argument("--slack-ms", type=float, default=5.0, help="Absolute slack so tiny timings don't flap")
+    parser.add_argument("--skip-load", action="store_true", help="Reuse the data already in the database")
+    parser.add_argument("--allow-remote", action="store_true", help="Allow a non-local BENCH_DATABASE_URL")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                        help="Fail if a cold `import main` takes longer than this")
+    args = parser.parse_args()
+
+    bench_url = os.getenv("BENCH_DATABASE_URL")
+    if not bench_url:
+        raise ValueError("BENCH_DATABASE_URL environment variable is not set (use a throwaway local database)")
+    if not is_local(bench_url) and not args.allow_remote:
+        raise ValueError("BENCH_DATABASE_URL is not local; benchmarks wipe the database (use --allow-remote)")
+
+    # The app modules read these when they first connect, so point them at the bench DB first
+    os.environ["DATABASE_URL"] = bench_url
+    os.environ.setdefault("FORECAST_CACHE_DIR", tempfile.mkdtemp(prefix="bench_forecast_cache_"))
+    os.environ.setdefault("FORECAST_REFRESH_INTERVAL", "86400")  # No background refits mid-measurement
+
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "scales": {},
+    }
+
+    results["import_time"] = measure_import_time("main")
+    print(f"⏱️  import main: {results['import_time']['total_ms']}ms (budget {args.import_budget_ms:.0f}ms)")
+    for name, ms in results["import_time"]["slowest"].items():
+        print(f"   {name:<38} {ms:>8.1f}ms")
+
+    for scale in args.scales:
+        results["scales"][scale] = {
+            "dataset": SCALES[scale],
+            "targets": run_scale(scale, args.repeat, args.skip_load),
+        }
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Baseline saved to {args.save_baseline}")
+
+    failed = False
+    if results["import_time"]["total_ms"] > args.import_budget_ms:
+        print(f"❌ import main took {results['import_time']['total_ms']}ms, over the "
+              f"{args.import_budget_ms:.0f}ms budget (something heavy is imported eagerly again?)")
+        failed = True
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.slack_ms)
+        if regressions:
+            print("❌ Performance regressions:")
+            for line in regressions:
+                print(f"   {line}")
+            failed = True
+        else:
+            print("✅ No regressions against the baseline.")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
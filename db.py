@@ -0,0 +1,159 @@
+import functools
+import os
+import threading
+import uuid
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.pool import NullPool
+
+# =========================================================
+# SHARED DATABASE ACCESS
+# Every entry point (API, scoring engine, ledger, seeder, consumer) gets its
+# connections from here: one sync engine and one async engine per process,
+# created on first use. Worst case per process:
+#   (DB_POOL_SIZE + DB_MAX_OVERFLOW) + (DB_ASYNC_POOL_SIZE + DB_ASYNC_MAX_OVERFLOW)
+# so multiply by the number of uvicorn workers when sizing max_connections.
+#
+# DB_PGBOUNCER=1: an external pooler (pgbouncer, transaction mode) owns the
+# connections, so we don't keep our own pool, don't use prepared statements
+# and don't send startup options it would reject.
+# =========================================================
+load_dotenv();
+
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+ASYNC_POOL_SIZE = int(os.getenv('DB_ASYNC_POOL_SIZE', '5'))
+ASYNC_MAX_OVERFLOW = int(os.getenv('DB_ASYNC_MAX_OVERFLOW', '5'))
+# Seconds to wait for a free connection before giving up
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Reconnect connections older than this (hosted Postgres / load balancers drop idle ones)
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+# Per-statement limit in ms (0 = none). Bulk jobs (seeder, full rescoring) may need it off.
+STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))
+PGBOUNCER = os.getenv('DB_PGBOUNCER', '0') == '1'
+APPLICATION_NAME = os.getenv('DB_APPLICATION_NAME', 'cacao')
+
+
+def database_url():
+    db_str = os.getenv('DATABASE_URL')
+    if not db_str:
+        raise ValueError("DATABASE_URL environment variable is not set")
+    return db_str
+
+
+def async_db_url(url):
+    """
+    Same database, asyncpg driver. asyncpg spells 'sslmode' as 'ssl'.
+    """
+    url = make_url(url).set(drivername="postgresql+asyncpg")
+    if "sslmode" in url.query:
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": url.query["sslmode"]})
+    return url
+
+
+def _pool_args(size, overflow):
+    if PGBOUNCER:
+        return {"poolclass": NullPool}
+    return {
+        "pool_size": size,
+        "max_overflow": overflow,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+
+
+# ---------------------------------------------------------
+# POOL STATS (checkouts are counted through pool events, so they work with NullPool too)
+# ---------------------------------------------------------
+_stats_lock = threading.Lock()
+_usage = {}  # engine name -> {"checked_out", "peak_checked_out", "checkouts"}
+_pools = {}  # engine name -> pool
+
+
+def _track(name, engine):
+    _pools[name] = engine.pool
+    _usage[name] = {"checked_out": 0, "peak_checked_out": 0, "checkouts": 0}
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_conn, record, proxy):
+        with _stats_lock:
+            usage = _usage[name]
+            usage["checked_out"] += 1
+            usage["checkouts"] += 1
+            usage["peak_checked_out"] = max(usage["peak_checked_out"], usage["checked_out"])
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_conn, record):
+        with _stats_lock:
+            _usage[name]["checked_out"] -= 1
+
+
+def _limit_statements_per_transaction(engine):
+    # pgbouncer shares server connections between clients, so a session-level SET
+    # would leak to someone else: scope the timeout to each transaction instead
+    @event.listens_for(engine, "begin")
+    def on_begin(conn):
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT_MS}")
+
+
+@functools.cache
+def get_engine():
+    """The process-wide sync engine (psycopg2). Created on first use."""
+    connect_args = {"application_name": APPLICATION_NAME}
+    if STATEMENT_TIMEOUT_MS and not PGBOUNCER:
+        connect_args["options"] = f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"
+
+    engine = create_engine(database_url(), connect_args=connect_args, **_pool_args(POOL_SIZE, MAX_OVERFLOW))
+    if STATEMENT_TIMEOUT_MS and PGBOUNCER:
+        _limit_statements_per_transaction(engine)
+    _track("sync", engine)
+    return engine
+
+
+@functools.cache
+def get_async_engine():
+    """The process-wide async engine (asyncpg), for the API's non-blocking queries."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    server_settings = {"application_name": APPLICATION_NAME}
+    connect_args = {"server_settings": server_settings}
+    if PGBOUNCER:
+        # Transaction pooling: a prepared statement may not exist on the next server
+        # connection, and names must not collide between clients sharing one
+        connect_args.update(
+            statement_cache_size=0,
+            prepared_statement_cache_size=0,
+            prepared_statement_name_func=lambda: f"__asyncpg_{uuid.uuid4()}__",
+        )
+    elif STATEMENT_TIMEOUT_MS:
+        server_settings["statement_timeout"] = str(STATEMENT_TIMEOUT_MS)
+
+    engine = create_async_engine(
+        async_db_url(database_url()), connect_args=connect_args, **_pool_args(ASYNC_POOL_SIZE, ASYNC_MAX_OVERFLOW)
+    )
+    if STATEMENT_TIMEOUT_MS and PGBOUNCER:
+        _limit_statements_per_transaction(engine.sync_engine)
+    _track("async", engine.sync_engine)
+    return engine
+
+
+def pool_stats():
+    """
+    {engine name: {"size", "checked_out", "idle", "overflow", "peak_checked_out", "checkouts"}}
+    for the engines this process has created. size/idle/overflow are None under DB_PGBOUNCER=1.
+    """
+    stats = {}
+    with _stats_lock:
+        usage = {name: dict(values) for name, values in _usage.items()}
+    for name, pool in _pools.items():
+        queued = not isinstance(pool, NullPool)
+        stats[name] = {
+            "size": pool.size() if queued else None,
+            "idle": pool.checkedin() if queued else None,
+            "overflow": max(0, pool.overflow()) if queued else None,
+            **usage[name],
+        }
+    return stats
@@ -0,0 +1,127 @@
+-- Partitioned variant of db_schema.sql, for years of history / tens of millions of rows:
+-- transactions and production_logs are split by month (date) and indexed with BRIN.
+-- Load this instead of db_schema.sql, then create the partitions:
+--   python partitions.py
+-- Everything else (suppliers, scoring state, ledger, caches) is identical.
+
+-- Drop existing tables (in correct order due to foreign keys)
+DROP TABLE IF EXISTS partition_archive CASCADE;
+DROP TABLE IF EXISTS stock_ledger CASCADE;
+DROP TABLE IF EXISTS supplier_generation CASCADE;
+DROP TABLE IF EXISTS scoring_watermark CASCADE;
+DROP TABLE IF EXISTS supplier_score_aggregates CASCADE;
+DROP TABLE IF EXISTS production_logs CASCADE;
+DROP TABLE IF EXISTS transactions CASCADE;
+DROP TABLE IF EXISTS suppliers CASCADE;
+
+-- Create Suppliers table
+CREATE TABLE suppliers (
+    supplier_id VARCHAR(50) PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    location TEXT NOT NULL,
+    eligibility JSONB,
+    description JSONB,
+    reliability_score INT DEFAULT 0,
+
+    -- Typed copies of the JSONB fields scoring uses (kept in sync by Postgres).
+    -- Some rows hold the JSON double-encoded as a string, hence the CASE.
+    bearing_trees DOUBLE PRECISION GENERATED ALWAYS AS ((
+        (CASE WHEN jsonb_typeof(description) = 'string' THEN (description #>> '{}')::jsonb ELSE description END)
+        ->> 'bearing_trees')::float) STORED,
+    philgap_certified BOOLEAN GENERATED ALWAYS AS ((
+        (CASE WHEN jsonb_typeof(eligibility) = 'string' THEN (eligibility #>> '{}')::jsonb ELSE eligibility END)
+        ->> 'philgap_certified')::boolean) STORED
+);
+
+-- Create Transactions table (one partition per month of `date`)
+CREATE TABLE transactions (
+    transaction_id VARCHAR(50) NOT NULL,
+    supplier_id VARCHAR(50) NOT NULL,
+    amount INT NOT NULL,
+    price NUMERIC(10, 2) NOT NULL,
+    date TIMESTAMP NOT NULL DEFAULT NOW(),
+    quality JSONB,
+    status VARCHAR(50) NOT NULL,
+
+    -- Typed copies of the JSONB fields scoring uses (kept in sync by Postgres)
+    moldy_percent DOUBLE PRECISION GENERATED ALWAYS AS ((
+        (CASE WHEN jsonb_typeof(quality) = 'string' THEN (quality #>> '{}')::jsonb ELSE quality END)
+        -> 'cut_test_results' ->> 'moldy_percent')::float) STORED,
+    insect_damaged_percent DOUBLE PRECISION GENERATED ALWAYS AS ((
+        (CASE WHEN jsonb_typeof(quality) = 'string' THEN (quality #>> '{}')::jsonb ELSE quality END)
+        -> 'cut_test_results' ->> 'insect_damaged_percent')::float) STORED,
+    moisture_content DOUBLE PRECISION GENERATED ALWAYS AS ((
+        (CASE WHEN jsonb_typeof(quality) = 'string' THEN (quality #>> '{}')::jsonb ELSE quality END)
+        ->> 'moisture_content')::float) STORED,
+
+    -- A partitioned table's keys must include the partition column
+    PRIMARY KEY (transaction_id, date),
+    FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id) ON DELETE CASCADE
+) PARTITION BY RANGE (date);
+
+-- Create Production_logs table (one partition per month of `date`)
+CREATE TABLE production_logs (
+    log_id VARCHAR(50) NOT NULL,
+    date TIMESTAMP NOT NULL DEFAULT NOW(),
+    product_type VARCHAR(100) NOT NULL,
+    quantity INT NOT NULL,
+    supplier_id VARCHAR(50) NOT NULL,
+
+    PRIMARY KEY (log_id, date),
+    FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id) ON DELETE CASCADE
+) PARTITION BY RANGE (date);
+
+-- Rows outside every monthly partition land here instead of failing the insert.
+-- partitions.py creates months ahead of time and moves any strays out of it.
+CREATE TABLE transactions_default PARTITION OF transactions DEFAULT;
+CREATE TABLE production_logs_default PARTITION OF production_logs DEFAULT;
+
+-- Partitions detached by retention (partitions.py --retain-months): what they held,
+-- so the stock ledger check still adds up after the rows are gone
+CREATE TABLE partition_archive (
+    partition_name VARCHAR(100) PRIMARY KEY,
+    parent_table VARCHAR(100) NOT NULL,
+    range_start TIMESTAMP NOT NULL,
+    range_end TIMESTAMP NOT NULL,
+    row_count BIGINT NOT NULL,
+    total_kg BIGINT NOT NULL,
+    detached_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Incremental scoring state (maintained by scoring_engine.py)
+-- Running per-supplier totals, folded forward from the watermark below
+CREATE TABLE supplier_score_aggregates (
+    supplier_id VARCHAR(50) PRIMARY KEY,
+    last_delivery TIMESTAMP NOT NULL,
+    total_delivered BIGINT NOT NULL DEFAULT 0,
+    quality_sum BIGINT NOT NULL DEFAULT 0,
+    quality_count BIGINT NOT NULL DEFAULT 0,
+
+    FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id) ON DELETE CASCADE
+);
+
+-- Last (date, transaction_id) already folded into supplier_score_aggregates
+CREATE TABLE scoring_watermark (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    last_date TIMESTAMP NOT NULL,
+    last_transaction_id VARCHAR(50) NOT NULL
+);
+
+-- Create indexes for better query performance
+CREATE INDEX idx_transactions_supplier ON transactions(supplier_id);
+-- Rows arrive in date order, so a BRIN index (a few pages per partition) covers
+-- date-range scans that a B-tree would need gigabytes for
+CREATE INDEX idx_transactions_date ON transactions USING brin (date);
+CREATE INDEX idx_production_logs_supplier ON production_logs(supplier_id);
+CREATE INDEX idx_production_logs_date ON production_logs USING brin (date);
+-- Leaderboard pages: keyset on (reliability_score, supplier_id), read backwards
+CREATE INDEX idx_suppliers_leaderboard ON suppliers(reliability_score, supplier_id COLLATE "C");
+-- Quality filters on the typed columns, e.g. "certified suppliers with low mold"
+CREATE INDEX idx_transactions_moldy ON transactions(moldy_percent, supplier_id);
+CREATE INDEX idx_suppliers_philgap ON suppliers(supplier_id) WHERE philgap_certified;
+
+-- Running stock ledger (table + triggers on transactions/production_logs):
+-- run `python stock_ledger.py --install` after loading this schema.
+
+-- Supplier generation counter (table + statement trigger on suppliers), which
+-- versions the API's in-memory ranking: run `python supplier_cache.py --install`.
@@ -0,0 +1,524 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import text
+
+import analytics_snapshot
+import metrics
+
+# =========================================================
+# TRAINING SERIES
+# Prophet STRICTLY requires columns named 'ds' (date) and 'y' (value)
+# =========================================================
+def daily_series_query(table, column):
+    """
+    One row per calendar day (summed in SQL), with days that had no events filled
+    with 0. Training cost then grows with days of history, not with event count.
+    """
+    return f"""
+        WITH daily AS (
+            SELECT date_trunc('day', date) AS ds, SUM({column}) AS y
+            FROM {table}
+            GROUP BY 1
+        )
+        SELECT days.ds, COALESCE(daily.y, 0) AS y
+        FROM generate_series(
+            (SELECT MIN(ds) FROM daily), (SELECT MAX(ds) FROM daily), interval '1 day'
+        ) AS days(ds)
+        LEFT JOIN daily ON daily.ds = days.ds
+        ORDER BY days.ds
+    """
+
+
+def fingerprint_query(table, column):
+    return f"SELECT COUNT(*), MAX(date), COALESCE(SUM({column}), 0) FROM {table}"
+
+
+SERIES = {
+    # /predict-demand: historical consumption (date + weight)
+    "demand": {
+        "table": "transactions",
+        "column": "amount",
+        "query": daily_series_query("transactions", "amount"),
+        "fingerprint": fingerprint_query("transactions", "amount"),
+        # 'daily_seasonality=True' helps if you have data for every day
+        "prophet": {"daily_seasonality": True},
+    },
+    # /suggest-orders-smart: inflow (deliveries)
+    "supply": {
+        "table": "transactions",
+        "column": "amount",
+        "query": daily_series_query("transactions", "amount"),
+        "fingerprint": fingerprint_query("transactions", "amount"),
+        "prophet": {},
+    },
+    # /suggest-orders-smart: outflow (production usage)
+    "outflow": {
+        "table": "production_logs",
+        "column": "quantity",
+        "query": daily_series_query("production_logs", "quantity"),
+        "fingerprint": fingerprint_query("production_logs", "quantity"),
+        "prophet": {},
+    },
+}
+
+# mode=accurate: Prophet (seconds per fit). mode=fast: Holt-Winters in NumPy (milliseconds).
+MODES = ("accurate", "fast")
+# Simulated paths behind an interval (only drawn when intervals are asked for)
+INTERVAL_SAMPLES = int(os.getenv('FORECAST_INTERVAL_SAMPLES', '1000'))
+
+CACHE_DIR = os.getenv('FORECAST_CACHE_DIR', '.forecast_cache')
+CACHE_SIZE = int(os.getenv('FORECAST_CACHE_SIZE', '32'))
+# Background refresher: how often to re-check the data, and when a served forecast counts as stale
+REFRESH_INTERVAL = float(os.getenv('FORECAST_REFRESH_INTERVAL', '60'))
+MAX_AGE = float(os.getenv('FORECAST_MAX_AGE', '300'))
+# Processes used for Prophet fits (0 = fit inside the calling process)
+FIT_WORKERS = int(os.getenv('FORECAST_FIT_WORKERS', '2'))
+
+
+class ModelCache:
+    """
+    LRU cache of fitted Prophet models + their forecast, keyed by a fingerprint
+    of the training data. Models are kept in Prophet's JSON serialization, and
+    every entry is also written to disk so a restarted worker doesn't have to refit.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with open(self._path(key)) as f:
+                stored = json.load(f)
+            entry = {"model_json": stored["model"], "forecast": stored["forecast"]}
+            os.utime(self._path(key))  # Disk LRU order is by mtime
+        except (OSError, ValueError, KeyError):
+            return None  # Corrupt/partial/just-pruned file: treat as a miss and refit
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, model_json, forecast):
+        entry = {"model_json": model_json, "forecast": forecast}
+        self._remember(key, entry)
+        if not self.cache_dir:
+            return entry
+
+        # Write to a temp file first so readers never see half a model (one per
+        # writer: concurrent requests can store the same key at the same time)
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model": model_json, "forecast": forecast}, f)
+        os.replace(tmp_path, self._path(key))
+        self._prune_disk()
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune_disk(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                try:
+                    files.append((os.path.getmtime(os.path.join(self.cache_dir, name)), name))
+                except OSError:
+                    pass  # Pruned by another writer meanwhile
+        files.sort()
+        for _, name in files[:-self.max_entries]:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+model_cache = ModelCache()
+
+
+def fingerprint(engine, series):
+    """
+    Cheap summary of the training data (row count, newest date, total).
+    If none of these moved, the fitted model is still valid.
+    """
+    with metrics.stage("db.fingerprint", series=series), engine.connect() as conn:
+        row = conn.execute(text(SERIES[series]["fingerprint"])).one()
+    return analytics_snapshot.as_fingerprint(*row)
+
+
+def cache_key(series, data_fingerprint, periods, mode="accurate", intervals=False):
+    raw = json.dumps({
+        "series": series,
+        "mode": mode,
+        "prophet": SERIES[series]["prophet"],
+        "periods": periods,
+        "intervals": intervals,
+        "data": data_fingerprint,
+    }, sort_keys=True)
+    return f"{series}-{hashlib.sha1(raw.encode()).hexdigest()[:16]}"
+
+
+_fit_pool = None
+_fit_pool_lock = threading.Lock()
+
+
+def get_fit_pool():
+    """
+    One process pool shared by every request. Stan fitting is CPU-bound and the
+    Python glue around it holds the GIL, so threads wouldn't run fits side by side.
+    """
+    global _fit_pool
+    with _fit_pool_lock:
+        if _fit_pool is None and FIT_WORKERS > 0:
+            # 'spawn': forking a process that has DB connections and threads is asking for trouble
+            _fit_pool = ProcessPoolExecutor(
+                max_workers=FIT_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up_worker,
+            )
+        return _fit_pool
+
+
+def warm_up_worker():
+    """Pool initializer: pay for the Prophet import when the worker starts, not in its first fit."""
+    import prophet  # noqa: F401
+
+
+def shutdown_fit_pool():
+    global _fit_pool
+    with _fit_pool_lock:
+        if _fit_pool is not None:
+            _fit_pool.shutdown(wait=False, cancel_futures=True)
+            _fit_pool = None
+
+
+def fit_and_forecast(df, prophet_params, periods, intervals=False):
+    """
+    Runs in a pool worker: fit one model and sum its next `periods` days.
+    Returns (model_json, forecast, stage_timings) so nothing unpicklable crosses the
+    process boundary (the parent records the timings: metrics live there).
+    forecast is {"total", "lower", "upper", "daily"}; the bounds are None unless
+    intervals=True, daily is the per-day prediction.
+    """
+    from prophet import Prophet  # Imported here: it pulls in Stan + matplotlib (seconds)
+    from prophet.serialize import model_to_json
+
+    # 2. TRAIN AI: Fit the model to your data
+    # (uncertainty_samples=0: predict() skips its per-row simulations)
+    started = time.perf_counter()
+    m = Prophet(**prophet_params, uncertainty_samples=0)
+    m.fit(df)
+    fitted = time.perf_counter()
+
+    # 3. PREDICT: only the `periods` future days, not the whole history again
+    future = m.make_future_dataframe(periods=periods, include_history=False)
+    daily = m.predict(future)['yhat'].to_numpy()
+    forecast = {"total": float(daily.sum()), "lower": None, "upper": None, "daily": daily.tolist()}
+    timings = {"prophet.fit": fitted - started, "prophet.predict": time.perf_counter() - fitted}
+
+    if intervals:
+        # Interval of the TOTAL: sum every simulated path over the horizon, then take
+        # quantiles (adding up per-day bounds would overstate it)
+        sampled = time.perf_counter()
+        m.uncertainty_samples = INTERVAL_SAMPLES
+        path_totals = m.predictive_samples(future)['yhat'].sum(axis=0)
+        tail = (1 - m.interval_width) / 2
+        forecast["lower"], forecast["upper"] = (float(q) for q in np.quantile(path_totals, [tail, 1 - tail]))
+        timings["prophet.intervals"] = time.perf_counter() - sampled
+    return model_to_json(m), forecast, timings
+
+
+def holt_winters_forecast(y, periods, season=7, phi=0.98, history=730):
+    """
+    Additive Holt-Winters with a damped trend and weekly seasonality.
+    Every (alpha, beta, gamma) in a small grid is smoothed at the same time as one
+    NumPy array, and the combination with the lowest one-step-ahead error wins.
+    Only the last `history` days are used (smoothing has long forgotten anything older).
+    Returns the next `periods` predictions.
+    """
+    y = np.asarray(y, dtype=float)[-history:]
+    n = len(y)
+    if n < 2 * season:
+        season = 1  # Not even two full weeks: level + trend only
+
+    alpha, beta, gamma = (grid.ravel() for grid in np.meshgrid(
+        [0.05, 0.1, 0.2, 0.4, 0.6], [0.0, 0.05, 0.15], [0.05, 0.15, 0.3]
+    ))
+
+    # Initial state from the first one/two seasons
+    level = np.full(alpha.shape, y[:season].mean())
+    if n >= 2 * season:
+        trend = np.full(alpha.shape, (y[season:2 * season].mean() - y[:season].mean()) / season)
+    else:
+        trend = np.full(alpha.shape, y[1] - y[0])
+    seasonal = np.tile(y[:season] - y[:season].mean(), (len(alpha), 1))
+
+    sse = np.zeros(alpha.shape)
+    for t in range(n):
+        s = t % season
+        expected = level + phi * trend + seasonal[:, s]
+        sse += (y[t] - expected) ** 2
+        new_level = alpha * (y[t] - seasonal[:, s]) + (1 - alpha) * (level + phi * trend)
+        trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        seasonal[:, s] = gamma * (y[t] - new_level) + (1 - gamma) * seasonal[:, s]
+        level = new_level
+
+    best = np.argmin(sse)
+    steps = np.arange(1, periods + 1)
+    damped_trend = np.cumsum(phi ** steps) * trend[best]
+    return level[best] + damped_trend + seasonal[best, (n + steps - 1) % season]
+
+
+def fast_forecast(df, periods):
+    """mode=fast counterpart of fit_and_forecast (no model to keep, no intervals)."""
+    started = time.perf_counter()
+    daily = holt_winters_forecast(df['y'].to_numpy(), periods)
+    forecast = {"total": float(daily.sum()), "lower": None, "upper": None, "daily": daily.tolist()}
+    return None, forecast, {"holt_winters.fit_predict": time.perf_counter() - started}
+
+
+def _prepare(engine, series, periods, mode, intervals=False):
+    """
+    Cache lookup for one series. Returns ("done", forecast) on a hit / too little data
+    (forecast None), otherwise ("fit", (key, training_df)).
+    """
+    table = SERIES[series]["table"]
+    # A snapshot exported within ANALYTICS_SNAPSHOT_MAX_LAG spares even the fingerprint query
+    snapshot = analytics_snapshot.current(table)
+    if snapshot:
+        data_fingerprint = snapshot["fingerprint"]
+    else:
+        data_fingerprint = fingerprint(engine, series)
+        snapshot = analytics_snapshot.current(table, data_fingerprint)
+    if data_fingerprint["count"] < 2:
+        return "done", None
+
+    key = cache_key(series, data_fingerprint, periods, mode, intervals)
+    cached = model_cache.get(key)
+    if cached and "daily" not in cached["forecast"]:
+        cached = None  # Written before per-day predictions were kept: refit once
+    metrics.inc("cacao_forecast_cache_total", result="hit" if cached else "miss", series=series, mode=mode)
+    if cached:
+        return "done", {"lower": None, "upper": None, **cached["forecast"]}
+
+    import pandas as pd  # Loaded on first use (it's slow to import)
+
+    # 1. FETCH DATA (already one row per day): from the analytics snapshot if it's
+    # fresh, otherwise (or if it can't be read) from the database
+    df = None
+    if snapshot:
+        try:
+            with metrics.stage("snapshot.training_series", series=series):
+                df = analytics_snapshot.daily_totals(snapshot, SERIES[series]["column"])
+        except Exception as e:
+            print(f"⚠️ Analytics snapshot of {table} unreadable, using the database: {e}")
+    if analytics_snapshot.ENABLED:
+        metrics.inc("cacao_snapshot_reads_total", table=table, source="snapshot" if df is not None else "live")
+    if df is None:
+        with metrics.stage("db.training_series", series=series):
+            df = pd.read_sql(SERIES[series]["query"], engine)
+        metrics.inc("cacao_db_rows_fetched_total", len(df), query=f"training_series.{series}")
+    if len(df) < 2:
+        return "done", None  # AI needs at least 2 days of history
+    return "fit", (key, df)
+
+
+def forecast_many(engine, names, periods=30, mode="accurate", intervals=False):
+    """
+    Forecasts several series at once: the DB reads run concurrently, then every
+    cache miss is fitted in parallel on the shared process pool (mode=fast is
+    cheap enough to run right here).
+    Returns {series: {"total", "lower", "upper", "daily"} or None}. The bounds are
+    only filled with intervals=True in mode=accurate.
+    """
+    names = list(names)
+    intervals = intervals and mode == "accurate"
+    with ThreadPoolExecutor(max_workers=max(1, len(names))) as io:
+        prepared = dict(zip(names, io.map(lambda name: _prepare(engine, name, periods, mode, intervals), names)))
+
+    pool = get_fit_pool() if mode == "accurate" else None
+    forecasts, pending = {}, {}
+    for name, (state, value) in prepared.items():
+        if state == "done":
+            forecasts[name] = value
+            continue
+        key, df = value
+        if mode == "fast":
+            pending[name] = (key, fast_forecast(df, periods))
+            continue
+        args = (df, SERIES[name]["prophet"], periods, intervals)
+        pending[name] = (key, pool.submit(fit_and_forecast, *args) if pool else fit_and_forecast(*args))
+
+    for name, (key, job) in pending.items():
+        model_json, forecast, timings = job.result() if pool else job
+        for stage_name, seconds in timings.items():
+            metrics.observe("cacao_stage_duration_seconds", seconds, stage=stage_name, series=name)
+        model_cache.put(key, model_json, forecast)
+        forecasts[name] = forecast
+    return forecasts
+
+
+def forecast_totals(engine, names, periods=30, mode="accurate"):
+    """forecast_total for several series at once. Returns {series: total or None}."""
+    forecasts = forecast_many(engine, names, periods, mode)
+    return {name: forecast["total"] if forecast else None for name, forecast in forecasts.items()}
+
+
+def forecast_total(engine, series, periods=30, mode="accurate"):
+    """
+    Sum of predicted 'yhat' over the next `periods` days for one series.
+    Returns None when there isn't enough data to train (AI needs at least 2 points).
+    Repeat calls on unchanged data are answered from the model cache.
+    """
+    return forecast_totals(engine, [series], periods, mode)[series]
+
+
+class ForecastRefresher:
+    """
+    Stale-while-revalidate for the endpoints:
+    the latest completed forecast is always served straight away (with its age),
+    and refits happen on a background thread, never inside the request.
+    Both modes are kept warm, so even mode=fast doesn't scan the event tables per request.
+    """
+
+    def __init__(self, engine, series=tuple(SERIES), periods=30,
+                 interval=REFRESH_INTERVAL, max_age=MAX_AGE):
+        self.engine = engine
+        self.periods = periods
+        self.interval = interval
+        self.max_age = max_age
+        self._results = {}  # (series, periods, intervals, mode) -> {"forecast": dict|None, "computed_at": epoch}
+        self._keys = {(name, periods, False, mode) for name in series for mode in MODES}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _key(self, series, periods, intervals, mode):
+        # Only accurate mode has intervals: fast requests with/without share one entry
+        return (series, periods or self.periods, intervals and mode == "accurate", mode)
+
+    def refresh(self, series, periods=None, intervals=False, mode="accurate", if_missing=False):
+        """Recompute one forecast. Unchanged data is a cheap fingerprint check (ModelCache)."""
+        self.refresh_many([self._key(series, periods, intervals, mode)], if_missing=if_missing)
+
+    def refresh_many(self, keys, if_missing=False):
+        """
+        Recompute several forecasts together, so their fits run in parallel.
+        keys are (series, periods, intervals, mode) tuples.
+        """
+        keys = sorted(set(keys))  # Fixed lock order: no deadlock between overlapping calls
+        locks = [self._key_lock(key) for key in keys]
+        for lock in locks:
+            lock.acquire()
+        try:
+            if if_missing:
+                with self._lock:
+                    keys = [key for key in keys if key not in self._results]
+            groups = {}
+            for series, periods, intervals, mode in keys:
+                groups.setdefault((periods, intervals, mode), []).append(series)
+            for (periods, intervals, mode), names in groups.items():
+                forecasts = forecast_many(self.engine, names, periods, mode, intervals)
+                with self._lock:
+                    for series, forecast in forecasts.items():
+                        key = (series, periods, intervals, mode)
+                        self._results[key] = {"forecast": forecast, "computed_at": time.time()}
+                        self._keys.add(key)
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def _refresh_in_background(self, key):
+        if self._key_lock(key).locked():
+            return  # Already being refreshed
+
+        def run():
+            try:
+                self.refresh(*key)
+            except Exception as e:
+                print(f"❌ Background forecast refresh failed for {key[0]}: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def has_all(self, names, periods=None, intervals=False, mode="accurate"):
+        """True when latest_many() can answer straight from memory (no cold-start fit)."""
+        with self._lock:
+            return all(self._key(series, periods, intervals, mode) in self._results for series in names)
+
+    def latest(self, series, periods=None, intervals=False, mode="accurate"):
+        """
+        Returns (forecast, age_seconds), forecast being {"total", "lower", "upper", "daily"} or None.
+        Only blocks if this forecast has never been computed (cold start); a stale
+        one is returned as-is and refreshed behind it.
+        """
+        return self.latest_many([series], periods, intervals, mode)[series]
+
+    def latest_many(self, names, periods=None, intervals=False, mode="accurate"):
+        """latest() for several series; cold-start fits for all of them run together."""
+        keys = [self._key(series, periods, intervals, mode) for series in names]
+        with self._lock:
+            missing = [key for key in keys if key not in self._results]
+        if missing:
+            self.refresh_many(missing, if_missing=True)
+
+        results = {}
+        for key in keys:
+            with self._lock:
+                result = self._results[key]
+            age = time.time() - result["computed_at"]
+            if age > self.max_age:
+                self._refresh_in_background(key)
+            results[key[0]] = (result["forecast"], age)
+        return results
+
+    def _loop(self):
+        # First pass warms every forecast, later passes pick up new data
+        while not self._stop.is_set():
+            with self._lock:
+                keys = list(self._keys)
+            try:
+                self.refresh_many(keys)
+            except Exception as e:
+                print(f"❌ Background forecast refresh failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="forecast-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,101 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+
+# =========================================================
+# COALESCING BACKGROUND JOBS (in-process, no broker)
+# Used for score recalculation: however many times the button is pressed,
+# at most one run is in progress and at most one more is queued behind it.
+# Everything here runs on the event loop, so no locks are needed; the work
+# itself is an async callable (which hands the blocking part to a pool).
+# =========================================================
+
+
+class CoalescingJobs:
+    """
+    - nothing running: a trigger starts a run
+    - a run started but not yet running: the trigger joins it (it hasn't read anything yet)
+    - a run in progress: the trigger joins ONE queued follow-up run (the running
+      one may have read the data before whatever caused this trigger)
+    - a follow-up already queued: the trigger just gets its job back
+    Finished jobs are kept (newest `history`) so their status can be polled.
+    """
+
+    def __init__(self, work, history=100):
+        self.work = work
+        self.history = history
+        self._jobs = OrderedDict()  # job_id -> job dict (public view)
+        self._done = {}             # job_id -> asyncio.Event
+        self._running = None
+        self._queued = None
+        self._task = None
+
+    def trigger(self):
+        """Returns the job that will cover this request (new, queued or, at most, just started)."""
+        if self._queued is not None:
+            job = self._queued
+        elif self._running is not None and self._running["status"] == "queued":
+            job = self._running  # Its task hasn't begun: it will see this trigger's data too
+        elif self._running is not None:
+            job = self._queued = self._new_job()
+        else:
+            job = self._new_job()
+            self._start(job)
+        job["triggers"] += 1
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id, timeout):
+        """Waits up to `timeout` seconds for the job to finish; returns it either way."""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._done[job_id].wait()), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._jobs[job_id]
+
+    def _new_job(self):
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "triggers": 0,  # How many requests were coalesced into this run
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        self._jobs[job["job_id"]] = job
+        self._done[job["job_id"]] = asyncio.Event()
+        self._forget_old_jobs()
+        return job
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+            del self._done[job_id]
+
+    def _start(self, job):
+        self._running = job
+        self._task = asyncio.get_running_loop().create_task(self._execute(job))
+
+    async def _execute(self, job):
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        try:
+            job["result"] = await self.work()
+            job["status"] = "succeeded"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = time.time()
+            self._done[job["job_id"]].set()
+            self._running = None
+
+        if self._queued is not None:
+            follow_up, self._queued = self._queued, None
+            self._start(follow_up)
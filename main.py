@@ -1,159 +1,511 @@
+import asyncio
+import base64
+import cProfile
+import io
 import os
-import pandas as pd
-from fastapi import FastAPI
-from sqlalchemy import create_engine
-from prophet import Prophet
-import scoring_engine  # This imports the file you just made!
+import pstats
+import threading
+import time
+from enum import IntEnum
+from typing import Literal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import orjson
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+import admission  # Caps + queue deadline for forecasts computed inside a request
+import db  # Shared, tuned connection pools (sync + async)
+import forecasting  # Prophet models + the fitted-model cache (Prophet/pandas load on first use)
+import jobs  # Coalesced background jobs (score recalculation)
+import metrics  # Stage timers + counters behind /metrics
+import partitions  # Monthly partitions of the event tables (db_schema_partitioned.sql)
+import stock_ledger  # Trigger-maintained stock totals
+import stock_risk  # Monte Carlo stock-out simulation (NumPy)
+import supplier_cache  # In-memory supplier ranking, versioned by a generation counter
 from sqlalchemy import text  # Make sure this is imported at the top
 from dotenv import load_dotenv
-import uvicorn
 
 # Load environment variables from .env file
 load_dotenv()
 
 # To run : uvicorn main:app --reload
+# Keep this module cheap to import (worker boot, --reload): no DB connections and
+# no pandas/Prophet here. Engines are created in lifespan, heavy libraries on first use.
+
+
+# Set up by lifespan:
+# - engine: sync, for forecasting/scoring (pandas + Prophet need it anyway)
+# - async_engine: non-blocking, for the cheap I/O-bound queries (stock, supplier lists)
+# - forecast_refresher: keeps the demand/supply/outflow forecasts warm in a background thread
+# - score_jobs: score recalculations, one at a time, concurrent triggers coalesced
+# - supplier_rankings: the ranked suppliers in memory (top-k + leaderboard pages)
+# - forecast_admission: per mode, limits on forecasts computed inside requests
+# - io_pool / cpu_pool: see below
+engine = None
+async_engine = None
+forecast_refresher = None
+score_jobs = None
+supplier_rankings = None
+forecast_admission = None
+
+# Blocking work is handed to these explicitly, so it never occupies the event loop
+# and a few slow forecasts can't starve cheap requests:
+# - io_pool: sync calls that mostly wait (forecast lookups, sync DB reads)
+# - cpu_pool: pandas-heavy work in this process (scoring)
+# Created per lifespan (shut down at its end), so the app can be started again in
+# the same process (TestClient, benchmark.py)
+IO_POOL_WORKERS = int(os.getenv('IO_POOL_WORKERS', '8'))
+CPU_POOL_WORKERS = int(os.getenv('CPU_POOL_WORKERS', '2'))
+io_pool = None
+cpu_pool = None
+
+# Forecasts a request has to compute (cold starts the refresher hasn't warmed,
+# e.g. a new horizon): how many at once per mode, how many more may wait, and for how long (s) before a 503
+FORECAST_MAX_CONCURRENT = int(os.getenv('FORECAST_MAX_CONCURRENT', '2'))
+FORECAST_MAX_QUEUED = int(os.getenv('FORECAST_MAX_QUEUED', '16'))
+FORECAST_QUEUE_TIMEOUT = float(os.getenv('FORECAST_QUEUE_TIMEOUT', '10'))
+
+
+def import_scoring_engine():
+    import scoring_engine  # pandas-heavy, so it's loaded on first use instead of at import
+    return scoring_engine
+
+
+async def run_blocking(pool, fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+async def run_scoring():
+    # Across workers, the scoring engine's advisory lock still runs one at a time
+    result = await run_blocking(cpu_pool, lambda: import_scoring_engine().calculate_scores(raise_errors=True))
+    supplier_rankings.invalidate()  # Scores committed: don't wait out the check interval
+    return result
+
+
+class Horizon(IntEnum):
+    """Days ahead the forecasting endpoints accept (?horizon=7|30|90)."""
+    WEEK = 7
+    MONTH = 30
+    QUARTER = 90
+
+
+async def get_forecasts(names, mode, horizon=30, intervals=False):
+    """
+    {series: (forecast, age_seconds)} for the next `horizon` days, forecast being
+    {"total", "lower", "upper", "daily"} (bounds only with intervals=True) or None.
+    mode=accurate: Prophet; mode=fast: Holt-Winters (no intervals). Both are
+    served from memory by the background refresher.
+    Anything that has to be computed here (a cold start, e.g. a new horizon) goes
+    through admission control; raises HTTPException 429/503 (with Retry-After)
+    when the worker is too busy.
+    """
+    horizon = int(horizon)
+    intervals = intervals and mode == "accurate"
+    if forecast_refresher.has_all(names, horizon, intervals, mode):
+        # Already computed: straight from memory (stale ones refresh in the background)
+        return await run_blocking(io_pool, forecast_refresher.latest_many, names, horizon, intervals, mode)
+
+    async def compute():
+        return await run_blocking(io_pool, forecast_refresher.latest_many, names, horizon, intervals, mode)
+
+    try:
+        return await forecast_admission[mode].run((tuple(sorted(names)), horizon, intervals), compute)
+    except admission.Overloaded as e:
+        raise HTTPException(e.status_code, str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def interval_kg(forecast):
+    """{"lower", "upper"} in whole kg, or None when no interval was computed."""
+    if not forecast or forecast["lower"] is None:
+        return None
+    return {"lower": int(forecast["lower"]), "upper": int(forecast["upper"])}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global engine, async_engine, forecast_refresher, score_jobs, supplier_rankings, forecast_admission
+    global io_pool, cpu_pool
+
+    # Database Connection (DATABASE_URL + DB_* pool settings, see db.py).
+    # The scoring engine uses the same sync pool, so a worker holds at most two pools.
+    engine = db.get_engine()
+    async_engine = db.get_async_engine()
+    io_pool = ThreadPoolExecutor(max_workers=IO_POOL_WORKERS, thread_name_prefix="io")
+    cpu_pool = ThreadPoolExecutor(max_workers=CPU_POOL_WORKERS, thread_name_prefix="cpu")
+
+    # Loads pandas + the scoring engine off the event loop, so the first
+    # /update-scores doesn't pay for the import
+    threading.Thread(target=import_scoring_engine, name="warm-up", daemon=True).start()
+    # Keeps next months' partitions ahead of the inserts (no-op on the plain schema)
+    partitions_stop = threading.Event()
+    threading.Thread(target=partitions.keep_ahead, args=(partitions_stop,), name="partitions", daemon=True).start()
+
+    forecast_refresher = forecasting.ForecastRefresher(engine, periods=30)
+    forecast_refresher.start()  # Warms every forecast, then re-checks periodically
+    score_jobs = jobs.CoalescingJobs(run_scoring)
+    supplier_rankings = supplier_cache.SupplierCache(async_engine)
+    # Separate per mode, so cheap fast forecasts never queue behind Prophet fits
+    forecast_admission = {
+        mode: admission.AdmissionControl(mode, FORECAST_MAX_CONCURRENT, FORECAST_MAX_QUEUED, FORECAST_QUEUE_TIMEOUT)
+        for mode in forecasting.MODES
+    }
+    yield
+    partitions_stop.set()
+    forecast_refresher.stop()
+    forecasting.shutdown_fit_pool()
+    io_pool.shutdown(wait=False)
+    cpu_pool.shutdown(wait=False)
+    await async_engine.dispose()
+    engine.dispose()
+
+
+class TimedJSONResponse(JSONResponse):
+    """Default response class: orjson, timed so /metrics shows time spent serializing JSON."""
+
+    def render(self, content):
+        with metrics.stage("json.serialize"):
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+
+# ?profile=1 is only honoured when this is set (it exposes code internals)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    if PROFILING_ENABLED and request.query_params.get("profile") == "1":
+        return await profile_request(request, call_next)
+
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe(
+        "cacao_http_request_duration_seconds", time.perf_counter() - started,
+        method=request.method, route=getattr(route, "path", "unmatched"), status=response.status_code,
+    )
+    return response
+
+
+async def profile_request(request, call_next):
+    """
+    Runs the request under a profiler and returns the report instead of the response.
+    Uses pyinstrument (async-aware, sampling) if installed, else cProfile.
+    Note: only the event-loop thread is profiled; work handed to the thread/process
+    pools shows up as time spent waiting on them.
+    """
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+
+    if Profiler:
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        response = await call_next(request)
+        async for _ in response.body_iterator:
+            pass
+        profiler.stop()
+        return PlainTextResponse(profiler.output_text(unicode=True))
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    response = await call_next(request)
+    async for _ in response.body_iterator:
+        pass
+    profiler.disable()
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(40)
+    return PlainTextResponse(report.getvalue())
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: request latency, stage timers, row + cache counters, pool usage."""
+    for engine_name, stats in db.pool_stats().items():
+        for state in ("checked_out", "idle", "overflow", "peak_checked_out"):
+            if stats[state] is not None:
+                metrics.set_gauge("cacao_db_pool_connections", stats[state], engine=engine_name, state=state)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# =========================================================
+# THE LEADERBOARD (suppliers by score, highest first)
+# Keyset pagination on (reliability_score, supplier_id): every page is one
+# index range scan (idx_suppliers_leaderboard), no matter how deep it is.
+# supplier_id is compared with COLLATE "C" (byte order), the same order the
+# in-memory SupplierCache sorts by, so cached and DB pages line up.
+# =========================================================
+# 🟢 FIX: Replaced non-existent 'compliance_status' with 'eligibility'
+LEADERBOARD_COLUMNS = ("supplier_id", "name", "location", "reliability_score", "description", "eligibility")
+# The JSONB blobs (description, eligibility) are only sent when asked for
+LEADERBOARD_DEFAULT_FIELDS = "supplier_id,name,location,reliability_score"
+LEADERBOARD_MAX_LIMIT = 500
+
+
+def leaderboard_columns(fields):
+    """?fields=a,b,c -> validated column list (always includes the keyset columns)."""
+    columns = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = sorted(set(columns) - set(LEADERBOARD_COLUMNS))
+    if unknown:
+        raise HTTPException(400, f"Unknown field(s): {', '.join(unknown)}. Choose from: {', '.join(LEADERBOARD_COLUMNS)}")
+    for key in ("supplier_id", "reliability_score"):
+        if key not in columns:
+            columns.append(key)
+    return columns
+
+
+def leaderboard_query(columns, after=False, limit=False):
+    # Columns are whitelisted above, so formatting them in is safe
+    query = f"SELECT {', '.join(columns)} FROM suppliers WHERE reliability_score IS NOT NULL"
+    if after:
+        query += ' AND (reliability_score, supplier_id COLLATE "C") < (:score, :supplier_id)'
+    query += ' ORDER BY reliability_score DESC, supplier_id COLLATE "C" DESC'
+    if limit:
+        query += " LIMIT :limit"
+    return query
 
-app = FastAPI()
 
-# Database Connection (from environment variable)
-# !!pip install python-dotenv!!
-db_str = os.getenv('DATABASE_URL')
-if not db_str:
-    raise ValueError("DATABASE_URL environment variable is not set")
-engine = create_engine(db_str)
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(orjson.dumps([row["reliability_score"], row["supplier_id"]])).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        score, supplier_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"score": int(score), "supplier_id": str(supplier_id)}
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+
+
+async def fetch_leaderboard_page(columns, cursor, limit):
+    """One page of the leaderboard. Returns (rows, next_cursor or None on the last page)."""
+    params = {"limit": limit + 1}  # One extra row tells us whether there is a next page
+    if cursor:
+        params.update(decode_cursor(cursor))
+
+    # Compact columns only: served from memory unless the page runs past the cached rows
+    if set(columns) <= set(supplier_cache.CACHED_COLUMNS) and await supplier_rankings.refresh() is not None:
+        after = (params["score"], params["supplier_id"]) if cursor else None
+        page = supplier_rankings.page(after, limit)
+        if page is not None:
+            metrics.inc("cacao_supplier_cache_total", result="hit")
+            cached, has_more = page
+            rows = [{column: row[column] for column in columns} for row in cached]
+            return rows, encode_cursor(rows[-1]) if has_more else None
+        metrics.inc("cacao_supplier_cache_total", result="miss")
+
+    with metrics.stage("db.leaderboard"):
+        async with async_engine.connect() as conn:
+            result = await conn.execute(text(leaderboard_query(columns, after=bool(cursor), limit=True)), params)
+            rows = [dict(row) for row in result.mappings()]
+    metrics.inc("cacao_db_rows_fetched_total", len(rows), query="leaderboard")
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
+
+
+@app.get("/leaderboard")
+async def get_leaderboard(
+    request: Request,
+    cursor: str | None = None,
+    limit: int = Query(50, ge=1, le=LEADERBOARD_MAX_LIMIT),
+    fields: str = LEADERBOARD_DEFAULT_FIELDS,
+):
+    """
+    Suppliers by score, one page at a time. Pass the returned next_cursor to get the
+    next page. ?fields=supplier_id,name,description picks the columns.
+    Sends an ETag (the supplier generation): poll with If-None-Match to get a bodiless
+    304 until the suppliers change.
+    """
+    columns = leaderboard_columns(fields)
+    generation = await supplier_rankings.refresh()
+    headers = {}
+    if generation is not None:
+        # Weak: the same page can be rendered from memory or from the DB
+        headers = {"ETag": f'W/"suppliers-{generation}"', "Cache-Control": "no-cache"}
+        if headers["ETag"] in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+    rows, next_cursor = await fetch_leaderboard_page(columns, cursor, limit)
+    return TimedJSONResponse({"status": "success", "data": rows, "next_cursor": next_cursor}, headers=headers)
+
+
+@app.get("/leaderboard/export")
+async def export_leaderboard(fields: str = LEADERBOARD_DEFAULT_FIELDS):
+    """
+    The whole leaderboard as NDJSON (one supplier per line), streamed from a
+    server-side cursor: memory stays flat however many suppliers there are.
+    """
+    columns = leaderboard_columns(fields)
+
+    async def lines():
+        fetched = 0
+        async with async_engine.connect() as conn:
+            result = await conn.stream(text(leaderboard_query(columns)))
+            async for rows in result.mappings().partitions(1000):
+                fetched += len(rows)
+                yield b"".join(orjson.dumps(dict(row)) + b"\n" for row in rows)
+        metrics.inc("cacao_db_rows_fetched_total", fetched, query="leaderboard_export")
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 # =========================================================
 # PART 1: THE TRIGGER (Connects Web App -> Scoring Engine)
 # =========================================================
 @app.post("/update-scores")
-def trigger_scoring_logic():
+async def trigger_scoring_logic(
+    wait: float = Query(0, ge=0, le=300),
+    limit: int = Query(50, ge=1, le=LEADERBOARD_MAX_LIMIT),
+    fields: str = LEADERBOARD_DEFAULT_FIELDS,
+):
     """
-    1. RUNS the Math (updates the database).
-    2. FETCHES the new Leaderboard immediately.
-    3. RETURNS it to the Web App.
+    1. QUEUES the Math as a job and returns its id straight away (202).
+       Presses while a run is going share ONE follow-up run.
+    2. With ?wait=N, waits up to N seconds for it and FETCHES the new Leaderboard
+       (first page, see /leaderboard).
+    3. RETURNS it to the Web App. Poll GET /score-jobs/{job_id} otherwise.
     """
+    columns = leaderboard_columns(fields)
     try:
         print("Received signal: Updating Supplier Scores...")
 
-        # STEP 1: Run the hardcoded logic to update the DB
-        scoring_engine.calculate_scores()
+        # STEP 1: Queue the hardcoded logic that updates the DB
+        job = score_jobs.trigger()
+        if wait:
+            job = await score_jobs.wait(job["job_id"], wait)
+        if job["status"] == "failed":
+            return {"status": "error", "detail": job["error"], "job": job}
+        if job["status"] != "succeeded":
+            return TimedJSONResponse({
+                "status": "accepted",
+                "message": "Score update queued. Poll /score-jobs/{job_id}.",
+                "job": job
+            }, status_code=202)
 
         # STEP 2: Immediately query the fresh data
-        # We want the list sorted by Score (Highest first)
-        # 🟢 FIX: Replaced non-existent 'compliance_status' with 'eligibility'
-        query = """
-            SELECT supplier_id, name, location, reliability_score, 
-                   description  , eligibility
-            FROM suppliers
-            ORDER BY reliability_score DESC
-            """
-
-        # Read into Pandas
-        df = pd.read_sql(query, engine)
-
-        # STEP 3: Convert to JSON
-        # 'orient="records"' turns the table into a nice list of objects
-        data_list = df.to_dict(orient="records")
+        # We want the list sorted by Score (Highest first): the first page of
+        # the leaderboard, the rest is one GET /leaderboard?cursor=... away
+        data_list, next_cursor = await fetch_leaderboard_page(columns, None, limit)
 
-        return {
+        # STEP 3: Return it (already plain dicts, straight to orjson)
+        return TimedJSONResponse({
             "status": "success",
             "message": "Supplier scores updated and fetched.",
-            "data": data_list  # <--- THIS IS WHAT HE WANTS
-        }
+            "data": data_list,  # <--- THIS IS WHAT HE WANTS
+            "next_cursor": next_cursor,
+            "job": job
+        })
 
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
 
+@app.get("/score-jobs/{job_id}")
+async def get_score_job(job_id: str, wait: float = Query(0, ge=0, le=300)):
+    """
+    Status of a score update: queued / running / succeeded / failed.
+    ?wait=N holds the request up to N seconds for it to finish.
+    """
+    if score_jobs.get(job_id) is None:
+        raise HTTPException(404, "Unknown job (finished jobs are only kept for a while)")
+    job = await score_jobs.wait(job_id, wait) if wait else score_jobs.get(job_id)
+    return {"status": "success", "job": job}
+
+
 # =========================================================
 # PART 2: THE AI (Smart Demand Forecasting)
 # =========================================================
 @app.get("/predict-demand")
-def predict_demand():
+async def predict_demand(
+    mode: Literal["accurate", "fast"] = "accurate",
+    horizon: Horizon = Horizon.MONTH,
+    intervals: bool = False,
+):
     """
     The Web App calls this to show the "Future Demand" graph.
     This uses Facebook Prophet to analyze historical trends.
+    The forecast itself is precomputed by the background refresher.
+    ?mode=fast swaps Prophet for a millisecond Holt-Winters forecast.
+    ?horizon=7|30|90 picks the days ahead; ?intervals=true adds an uncertainty
+    range for the total (accurate mode only: it costs extra sampling).
     """
     try:
-        # 1. FETCH DATA: Get historical consumption (date + weight)
-        # Prophet STRICTLY requires columns named 'ds' (date) and 'y' (value)
-        query = """
-            SELECT date as ds, net_weight_kg as y 
-            FROM transactions 
-            ORDER BY date
-            """
-        df = pd.read_sql(query, engine)
+        # Latest completed forecast (refreshed in the background, never here)
+        forecasts = await get_forecasts(["demand"], mode, horizon, intervals)
+        forecast, forecast_age = forecasts["demand"]
 
         # Safety Check: AI needs at least 2 data points to work
-        if len(df) < 2:
+        if forecast is None:
             return {
                 "status": "warning",
                 "message": "Not enough data to train AI yet. Add more transactions.",
                 "forecast_total": 0
             }
 
-        # 2. TRAIN AI: Fit the model to your data
-        # 'daily_seasonality=True' helps if you have data for every day
-        m = Prophet(daily_seasonality=True)
-        m.fit(df)
-
-        # 3. PREDICT: Look 30 days into the future
-        future = m.make_future_dataframe(periods=30)
-        forecast = m.predict(future)
-
-        # 4. CALCULATE: Sum of expected demand for the next 30 days
-        # We take the last 30 entries of the prediction
-        next_30_days = forecast.tail(30)
-        total_predicted_demand = next_30_days['yhat'].sum()
-
-        return {
+        response = {
             "status": "success",
-            "forecast_total_kg": int(total_predicted_demand),
+            "forecast_total_kg": int(forecast["total"]),
+            "horizon_days": int(horizon),
+            "forecast_age_seconds": int(forecast_age),
             "message": "Prediction complete based on historical seasonality."
         }
+        if intervals:
+            response["forecast_interval_kg"] = interval_kg(forecast)
+        return response
 
+    except HTTPException:
+        raise  # Overloaded: 429/503 with Retry-After
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
 
 @app.get("/suggest-orders-smart")
-def suggest_orders_smart():
+async def suggest_orders_smart(
+    mode: Literal["accurate", "fast"] = "accurate",
+    horizon: Horizon = Horizon.MONTH,
+    intervals: bool = False,
+):
     """
     The Smartest AI Logic:
     1. Check 'Storage' (Current Stock).
-    2. Predict 'Future Flow' (Inflow/Outflow).
+    2. Predict 'Future Flow' (Inflow/Outflow) over the next `horizon` days.
     3. Calculate the 'True Deficit' and suggest orders from top suppliers.
     """
     try:
+        # Steps 1 + 2 and the supplier ranking don't depend on each other: run them side by side
         # --- STEP 1: CHECK CURRENT STORAGE ---
-        current_stock_kg = get_current_warehouse_stock()
-
-        # --- STEP 2: PREDICT FUTURE FLOW (Separate models for I/O) ---
+        # --- STEP 2: PREDICT FUTURE FLOW (Separate models for I/O, fitted in parallel) ---
+        current_stock_kg, flows, top_suppliers = await asyncio.gather(
+            get_current_warehouse_stock(),
+            get_forecasts(["supply", "outflow"], mode, horizon, intervals),
+            get_top_suppliers(3),
+        )
 
         # 2a. Supply Forecast
-        df_supply = pd.read_sql("SELECT date as ds, amount as y FROM transactions", engine)
-        if len(df_supply) >= 2:
-            m_supply = Prophet().fit(df_supply)
-            future_supply = m_supply.predict(m_supply.make_future_dataframe(periods=30))
-            # FIX 1: Use max(0, ...) to prevent negative predictions
-            predicted_inflow = max(0.0, float(future_supply.tail(30)['yhat'].sum()))
-        else:
-            predicted_inflow = 0.0
+        supply_forecast, supply_age = flows["supply"]
+        # FIX 1: Use max(0, ...) to prevent negative predictions
+        predicted_inflow = max(0.0, supply_forecast["total"]) if supply_forecast else 0.0
 
         # 2b. Demand Forecast
-        df_demand = pd.read_sql("SELECT date as ds, quantity as y FROM production_logs", engine)
-        if len(df_demand) >= 2:
-            m_demand = Prophet().fit(df_demand)
-            future_demand = m_demand.predict(m_demand.make_future_dataframe(periods=30))
-            # FIX 1: Use max(0, ...) to prevent negative predictions
-            predicted_outflow = max(0.0, float(future_demand.tail(30)['yhat'].sum()))
-        else:
-            predicted_outflow = 0.0
+        outflow_forecast, outflow_age = flows["outflow"]
+        # FIX 1: Use max(0, ...) to prevent negative predictions
+        predicted_outflow = max(0.0, outflow_forecast["total"]) if outflow_forecast else 0.0
 
         # --- STEP 3: CALCULATE PROJECTED BALANCE ---
         # Current Stock + Predicted Inflow - Predicted Outflow
         projected_balance = (float(current_stock_kg) + predicted_inflow) - predicted_outflow
+        forecast_info = {"horizon_days": int(horizon), "forecast_age_seconds": int(max(supply_age, outflow_age))}
+        if intervals:
+            forecast_info["forecast_intervals_kg"] = {
+                "inflow": interval_kg(supply_forecast),
+                "outflow": interval_kg(outflow_forecast),
+            }
 
         # --- STEP 4: DECISION LOGIC ---
         # FIX 2: Raise Safety Buffer to 2,000kg (approx 40 sacks).
@@ -168,20 +520,14 @@ def suggest_orders_smart():
                 "analysis": {
                     "current_storage": int(current_stock_kg),
                     "projected_end_stock": int(projected_balance),
-                    "required_purchase_kg": 0
+                    "required_purchase_kg": 0,
+                    **forecast_info
                 }
             }
 
         # SCENARIO B: We are running low (CRITICAL)
         true_deficit = (safety_buffer - projected_balance)
 
-        # Get Top Ranked Suppliers
-        top_suppliers = pd.read_sql("""
-            SELECT name, reliability_score 
-            FROM suppliers 
-            ORDER BY reliability_score DESC LIMIT 3
-        """, engine).to_dict(orient="records")
-
         # Distribute the order amount
         suggested_orders = []
         # Ensure we don't divide by zero if no suppliers found
@@ -201,28 +547,110 @@ def suggest_orders_smart():
             "analysis": {
                 "current_storage": int(current_stock_kg),
                 "predicted_usage_spike": int(predicted_outflow),
-                "required_purchase_kg": int(true_deficit)
+                "required_purchase_kg": int(true_deficit),
+                **forecast_info
             },
             "ai_suggestion": suggested_orders
 
         }
 
+    except HTTPException:
+        raise  # Overloaded: 429/503 with Retry-After
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
-def get_current_warehouse_stock():
+
+@app.get("/stockout-risk")
+async def stockout_risk(
+    mode: Literal["accurate", "fast"] = "accurate",
+    horizon: Horizon = Horizon.MONTH,
+    scenarios: int = Query(10_000, ge=100, le=100_000),
+    service_level: float = Query(0.95, gt=0, lt=1),
+    min_stock_kg: int = Query(0, ge=0),
+    lead_time_days: int = Query(0, ge=0),
+    seed: int | None = None,
+):
+    """
+    The odds version of /suggest-orders-smart:
+    1. Simulate `scenarios` possible next-`horizon`-days of deliveries and production
+       (per-day supply/outflow forecasts + the lumpiness/noise seen in the history).
+    2. Report, per day, the chance of being below `min_stock_kg` (a stock-out).
+    3. Size the order that keeps `service_level` of the scenarios covered, if it
+       arrives `lead_time_days` from now.
+    """
+    if lead_time_days >= horizon:
+        raise HTTPException(400, "lead_time_days must be shorter than the horizon")
+    try:
+        current_stock_kg, flows, history = await asyncio.gather(
+            get_current_warehouse_stock(),
+            get_forecasts(["supply", "outflow"], mode, horizon),
+            run_blocking(io_pool, stock_risk.load_history, engine),
+        )
+        supply_forecast, supply_age = flows["supply"]
+        outflow_forecast, outflow_age = flows["outflow"]
+        if outflow_forecast is None:
+            return {
+                "status": "warning",
+                "message": "Not enough production history to simulate yet. Add more logs.",
+            }
+        inflow_daily = supply_forecast["daily"] if supply_forecast else [0.0] * int(horizon)
+
+        def simulate():
+            with metrics.stage("risk.simulate"):
+                stock = stock_risk.simulate_stock(
+                    current_stock_kg, inflow_daily, outflow_forecast["daily"], history,
+                    scenarios, seed,
+                )
+                return stock_risk.summarize(stock, service_level, min_stock_kg, lead_time_days)
+
+        risk = await run_blocking(cpu_pool, simulate)
+        return {
+            "status": "success",
+            "analysis": {
+                "current_storage": int(current_stock_kg),
+                "horizon_days": int(horizon),
+                "scenarios": scenarios,
+                "service_level": service_level,
+                "min_stock_kg": min_stock_kg,
+                "lead_time_days": lead_time_days,
+                "forecast_age_seconds": int(max(supply_age, outflow_age)),
+                **risk,
+            },
+        }
+
+    except HTTPException:
+        raise  # Overloaded: 429/503 with Retry-After
+    except Exception as e:
+        return {"status": "error", "detail": str(e)}
+
+
+async def get_top_suppliers(limit):
+    """
+    Get Top Ranked Suppliers (from the in-memory ranking when it's installed)
+    """
+    if await supplier_rankings.refresh() is not None:
+        return [{"name": row["name"], "reliability_score": row["reliability_score"]}
+                for row in supplier_rankings.top(limit)]
+
+    with metrics.stage("db.top_suppliers"):
+        async with async_engine.connect() as conn:
+            result = await conn.execute(text("""
+                SELECT name, reliability_score
+                FROM suppliers
+                WHERE reliability_score IS NOT NULL
+                ORDER BY reliability_score DESC, supplier_id COLLATE "C" DESC LIMIT :limit
+            """), {"limit": limit})
+            return [dict(row) for row in result.mappings()]
+
+
+async def get_current_warehouse_stock():
     """
-    Calculates Real-Time Stock by summing inputs and outputs separately.
+    Real-Time Stock, read from the running ledger that triggers keep in sync with
+    transactions (in) and production_logs (out). See stock_ledger.py.
     """
-    # We use two separate subqueries to avoid multiplying the rows
-    sql_query = """
-        SELECT 
-            (SELECT COALESCE(SUM(amount), 0) FROM transactions) - 
-            (SELECT COALESCE(SUM(quantity), 0) FROM production_logs) 
-        as current_stock_kg
-        """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql_query))
-        current_stock = result.scalar() or 0.0
+    with metrics.stage("db.current_stock"):
+        async with async_engine.connect() as conn:
+            result = await conn.execute(text(stock_ledger.CURRENT_STOCK_QUERY))
+            current_stock = result.scalar() or 0.0
 
     return float(max(0, current_stock))
\ No newline at end of file
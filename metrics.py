@@ -0,0 +1,109 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# =========================================================
+# LIGHTWEIGHT METRICS (Prometheus text format, no dependencies)
+# - stage("db.current_stock"): times a block into cacao_stage_duration_seconds
+# - inc("cacao_db_rows_fetched_total", n, query="..."): counters
+# - set_gauge(name, value, **labels): point-in-time values (e.g. pool usage)
+# - render(): the /metrics payload
+# =========================================================
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "cacao_http_request_duration_seconds": "HTTP request latency by route",
+    "cacao_stage_duration_seconds": "Time spent in a named stage (DB query, model fit/predict, serialization)",
+    "cacao_db_rows_fetched_total": "Rows read from the database, by query",
+    "cacao_forecast_cache_total": "Forecast model cache lookups, by result (hit/miss)",
+    "cacao_supplier_cache_total": "Leaderboard pages served from the supplier cache, by result (hit/miss)",
+    "cacao_admission_total": "Forecast computations by admission result (admitted/shared/rejected/timed_out), per mode",
+    "cacao_admission_requests": "Forecast computations running / queued for a slot, per mode",
+    "cacao_snapshot_reads_total": "History reads by source (analytics snapshot or live database), by table",
+    "cacao_db_pool_connections": "Connection pool usage per engine (checked_out/idle/overflow/peak_checked_out)",
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_gauges = {}      # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket_counts, sum, count]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        index = bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            hist[0][index] += 1  # Cumulated at render time
+        hist[1] += seconds
+        hist[2] += 1
+
+
+@contextmanager
+def stage(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("cacao_stage_duration_seconds", time.perf_counter() - started, stage=name, **labels)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def render():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in _histograms.items())
+
+    seen = set()
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for (name, labels), value in values:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), (buckets, total, count) in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, buckets):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,220 @@
+import argparse
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+import db
+
+# =========================================================
+# MONTHLY PARTITIONS (db_schema_partitioned.sql)
+# transactions / production_logs are range-partitioned by month of `date`.
+# This keeps the monthly partitions ahead of the calendar, moves rows that
+# fell into the DEFAULT partition out of it, and (only when asked) detaches
+# months older than the retention window.
+#
+#   python partitions.py                      # create/cover months (cron: daily)
+#   python partitions.py --retain-months 24   # + detach older months (kept as tables)
+#   python partitions.py --retain-months 24 --drop
+#
+# The API also runs the first one in the background (at startup, then every
+# PARTITION_CHECK_INTERVAL seconds). On the plain db_schema.sql
+# (unpartitioned tables) every function here is a no-op.
+# =========================================================
+
+# Table -> the column that feeds the stock ledger (recorded when a month is detached)
+PARTITIONED_TABLES = {"transactions": "amount", "production_logs": "quantity"}
+
+# Months created past the current one, so inserts never wait on a CREATE TABLE
+MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+# Default for --retain-months (0 = keep everything)
+RETENTION_MONTHS = int(os.getenv('PARTITION_RETENTION_MONTHS', '0'))
+# How often (s) the API re-runs ensure_partitions
+CHECK_INTERVAL = float(os.getenv('PARTITION_CHECK_INTERVAL', '86400'))
+
+# One maintenance run at a time across processes (every API worker runs one at startup)
+LOCK_QUERY = "SELECT pg_advisory_xact_lock(hashtext('partitions'))"
+
+PARTITIONED_QUERY = "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"
+
+MONTHLY_PARTITIONS_QUERY = """
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(:table)
+"""
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_{month:%Y_%m}"
+
+
+def is_partitioned(conn, table):
+    return conn.execute(text(PARTITIONED_QUERY), {"table": table}).scalar()
+
+
+def monthly_partitions(conn, table):
+    """{month start: partition name} of the attached monthly partitions (not the DEFAULT one)."""
+    pattern = re.compile(rf"^{table}_(\d{{4}})_(\d{{2}})$")
+    months = {}
+    for (name,) in conn.execute(text(MONTHLY_PARTITIONS_QUERY), {"table": table}):
+        match = pattern.match(name)
+        if match:
+            months[datetime(int(match[1]), int(match[2]), 1)] = name
+    return months
+
+
+def _insertable_columns(conn, table):
+    # Generated columns are recomputed by Postgres and can't be inserted into
+    return [row[0] for row in conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = :table AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """), {"table": table})]
+
+
+def create_month(conn, table, month):
+    """
+    Creates the partition for `month`. If rows for that month already sit in the
+    DEFAULT partition, they are moved into it in the same transaction. The move
+    goes straight between partitions, so the ledger's statement triggers on the
+    parent don't fire (the rows never leave the table).
+    """
+    name, default = partition_name(table, month), f"{table}_default"
+    bounds = {"start": month, "end": add_months(month, 1)}
+    strays = conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {default} WHERE date >= :start AND date < :end)"
+    ), bounds).scalar()
+
+    if strays:
+        # Postgres won't add a partition whose range has rows in DEFAULT
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{bounds['start']:%Y-%m-%d}') TO ('{bounds['end']:%Y-%m-%d}')"
+    ))
+    if strays:
+        columns = ", ".join(_insertable_columns(conn, table))
+        moved = conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {default} WHERE date >= :start AND date < :end RETURNING {columns}
+            )
+            INSERT INTO {name} ({columns}) SELECT {columns} FROM moved
+        """), bounds).rowcount
+        conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+        print(f"   {name}: moved {moved:,} rows out of {default}")
+    return name
+
+
+def ensure_partitions(first_month=None, months_ahead=MONTHS_AHEAD):
+    """
+    Makes sure every month from `first_month` (default: the oldest partition, or this
+    month) through `months_ahead` months from now has its partition, plus the
+    months of any rows sitting in DEFAULT.
+    Returns the names of the partitions created.
+    """
+    created = []
+    with db.get_engine().begin() as conn:
+        conn.execute(text(LOCK_QUERY))
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(conn, table):
+                continue
+            existing = monthly_partitions(conn, table)
+            # Rows stuck in DEFAULT widen the range, so they get moved out
+            oldest, newest = conn.execute(text(f"SELECT MIN(date), MAX(date) FROM {table}_default")).one()
+            first = min(filter(None, [
+                first_month and month_start(first_month),
+                oldest and month_start(oldest),
+                min(existing, default=None),
+                month_start(datetime.now()),
+            ]))
+            last = max(filter(None, [
+                newest and month_start(newest),
+                add_months(month_start(datetime.now()), months_ahead),
+            ]))
+
+            month = first
+            while month <= last:
+                if month not in existing:
+                    created.append(create_month(conn, table, month))
+                month = add_months(month, 1)
+    return created
+
+
+def keep_ahead(stop, interval=CHECK_INTERVAL):
+    """Background loop for the API: ensure_partitions now, then every `interval` s until `stop` is set."""
+    while True:
+        try:
+            created = ensure_partitions()
+            if created:
+                print(f"✅ Created partitions: {', '.join(created)}")
+        except Exception as e:
+            print(f"⚠️ Partition maintenance failed: {e}")
+        if stop.wait(interval):
+            return
+
+
+def detach_old_partitions(retain_months=RETENTION_MONTHS, drop=False):
+    """
+    Detaches the monthly partitions that end before the last `retain_months` months
+    (counting the current one). They stay as plain tables to archive (pg_dump -t) or,
+    with drop=True, are dropped. What each held is recorded in partition_archive, so
+    stock_ledger's check still balances. Returns the names detached.
+    """
+    if retain_months <= 0:
+        return []
+    cutoff = add_months(month_start(datetime.now()), 1 - retain_months)
+    detached = []
+    with db.get_engine().begin() as conn:
+        conn.execute(text(LOCK_QUERY))
+        for table, kg_column in PARTITIONED_TABLES.items():
+            if not is_partitioned(conn, table):
+                continue
+            for month, name in sorted(monthly_partitions(conn, table).items()):
+                if month >= cutoff:
+                    break
+                conn.execute(text(f"""
+                    INSERT INTO partition_archive (partition_name, parent_table, range_start, range_end, row_count, total_kg)
+                    SELECT :name, :table, :start, :end, COUNT(*), COALESCE(SUM({kg_column}), 0) FROM {name}
+                    ON CONFLICT (partition_name) DO NOTHING
+                """), {"name": name, "table": table, "start": month, "end": add_months(month, 1)})
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                if drop:
+                    conn.execute(text(f"DROP TABLE {name}"))
+                detached.append(name)
+    return detached
+
+
+def archived_totals(conn):
+    """{table: kg} held by detached partitions (zeros without db_schema_partitioned.sql)."""
+    totals = dict.fromkeys(PARTITIONED_TABLES, 0)
+    if conn.execute(text("SELECT to_regclass('partition_archive')")).scalar() is None:
+        return totals
+    for table, kg in conn.execute(text(
+        "SELECT parent_table, SUM(total_kg) FROM partition_archive GROUP BY parent_table"
+    )):
+        totals[table] = int(kg)
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of transactions/production_logs.")
+    parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD, help="Future months to create")
+    parser.add_argument("--retain-months", type=int, default=RETENTION_MONTHS,
+                        help="Detach months older than this many (0 = keep everything)")
+    parser.add_argument("--drop", action="store_true", help="Drop detached months instead of keeping them as tables")
+    args = parser.parse_args()
+
+    created = ensure_partitions(months_ahead=args.months_ahead)
+    print(f"✅ Partitions up to date ({len(created)} created{': ' + ', '.join(created) if created else ''}).")
+    detached = detach_old_partitions(args.retain_months, drop=args.drop)
+    if detached:
+        print(f"✅ {'Dropped' if args.drop else 'Detached'} {len(detached)} old partitions: {', '.join(detached)}")
@@ -1,22 +1,26 @@
+import argparse
+import json
+import random
+import threading
 import time
 import uuid
+import urllib.request
 from datetime import datetime
 
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
 import os
 import sys
 
+import db
+import seeder  # copy_frame (COPY bulk load)
+
 # ==========================================
 # 1. CONFIGURATION (Direct to Cloud)
 # ==========================================
-load_dotenv();
-
 try:
-    db_str = os.getenv('DATABASE_URL')
-    if not db_str:
-        raise ValueError("DATABASE_URL environment variable is not set")
-    engine = create_engine(db_str)
+    engine = db.get_engine()  # Shared pool, see db.py
     print("✅ Connected to Cloud Database successfully.")
 except Exception as e:
     print(f"❌ Connection Failed: {e}")
@@ -33,34 +37,66 @@ MENU = {
 }
 
 # Dummy supplier logic to satisfy your DB constraints
-# (We just pick the first one to avoid Foreign Key errors)
+# (usage needs an existing supplier, or the Foreign Key rejects it).
+# Set at startup by resolve_supplier_id (--supplier-id).
 DEFAULT_SUPPLIER_ID = "SUP-DVO-001"
+SUPPLIER_ID = DEFAULT_SUPPLIER_ID
+
+
+def resolve_supplier_id(requested=None):
+    """
+    `requested` if that supplier exists; otherwise DEFAULT_SUPPLIER_ID, or the first
+    supplier there is (e.g. only SUP-GEN-* after `seeder.py --suppliers N`).
+    """
+    with engine.connect() as conn:
+        if requested:
+            found = conn.execute(text("SELECT supplier_id FROM suppliers WHERE supplier_id = :id"),
+                                 {"id": requested}).scalar()
+            if found is None:
+                sys.exit(f"❌ Unknown supplier '{requested}' (see the suppliers table)")
+            return found
+        found = conn.execute(text("""
+            SELECT supplier_id FROM suppliers
+            ORDER BY supplier_id = :preferred DESC, supplier_id
+            LIMIT 1
+        """), {"preferred": DEFAULT_SUPPLIER_ID}).scalar()
+    if found is None:
+        sys.exit("❌ No suppliers yet: run seeder.py first")
+    return found
 
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
 
+INSERT_LOG_QUERY = text("""
+    INSERT INTO production_logs (log_id, date, product_type, quantity, supplier_id)
+    VALUES (:log_id, :date, :product_type, :quantity, :supplier_id)
+""")
+
+# Buffered writer: flush when this many events are waiting, or every N seconds
+BATCH_SIZE = 500
+FLUSH_INTERVAL_SEC = 1.0
+
+
+def usage_row(product_name, quantity_kg):
+    return {
+        # Full uuid: at thousands of events/sec, 8 hex chars collide within minutes
+        "log_id": f"LIVE-{uuid.uuid4().hex}",
+        "date": datetime.now(),
+        "product_type": product_name,
+        "quantity": quantity_kg,
+        "supplier_id": SUPPLIER_ID,  # An existing one, to prevent crashes
+    }
+
+
 def log_usage_to_db(product_name, quantity_kg, silent=False):
     """
     Inserts a record directly into the production_logs table.
     """
-    unique_id = f"LIVE-{uuid.uuid4().hex[:8]}"
-
-    query = text("""
-        INSERT INTO production_logs (log_id, date, product_type, quantity, supplier_id)
-        VALUES (:log_id, :date, :product_type, :quantity, :supplier_id)
-    """)
-
     try:
         with engine.begin() as conn:
-            conn.execute(query, {
-                "log_id": unique_id,
-                "date": datetime.now(),
-                "product_type": product_name,
-                "quantity": quantity_kg,
-                "supplier_id": DEFAULT_SUPPLIER_ID,  # Hardcoded to prevent crashes
-            })
+            conn.execute(INSERT_LOG_QUERY, usage_row(product_name, quantity_kg))
         if not silent:
             print(f"🚀 SENT: -{quantity_kg}kg ({product_name})")
         return True
@@ -69,6 +105,76 @@ def log_usage_to_db(product_name, quantity_kg, silent=False):
         return False
 
 
+class BufferedUsageWriter:
+    """
+    Queues usage events in memory and writes each batch with one COPY,
+    one transaction per batch, instead of one INSERT + transaction per event.
+    A batch goes out when `batch_size` events are waiting or every
+    `flush_interval` seconds (background thread), whichever comes first.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL_SEC):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.flush_seconds = []  # One entry per batch written (latency report in headless mode)
+        self.started_at = time.perf_counter()
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def add(self, product_name, quantity_kg):
+        with self._buffer_lock:
+            self._buffer.append(usage_row(product_name, quantity_kg))
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._buffer_lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+
+        with self._write_lock:
+            try:
+                started = time.perf_counter()
+                # COPY, not executemany (that would still be one INSERT per row)
+                raw_conn = engine.raw_connection()
+                try:
+                    frame = pd.DataFrame(batch)
+                    # quantity is INT: COPY won't round like an INSERT does (half away from zero)
+                    frame["quantity"] = np.floor(frame["quantity"] + 0.5).astype(int)
+                    seeder.copy_frame(raw_conn, "production_logs", frame)
+                    raw_conn.commit()
+                finally:
+                    raw_conn.close()
+                self.flush_seconds.append(time.perf_counter() - started)
+                self.rows_written += len(batch)
+            except Exception as e:
+                self.rows_failed += len(batch)
+                print(f"\n❌ DATABASE ERROR (batch of {len(batch)} dropped): {e}")
+        return len(batch)
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self.started_at
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        """Stops the background flusher and writes whatever is still queued."""
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+
+
 def run_auto_drain():
     """
     The 'Real-Time' Loop Feature
@@ -76,27 +182,192 @@ def run_auto_drain():
     print("\n--- 🔄 AUTO-DRAIN CONFIGURATION ---")
     try:
         kg_per_tick = float(input("   🔥 How many KG to burn per tick? (e.g., 2): "))
-        speed_sec = float(input("   ⏱️  How many seconds per tick? (e.g., 1): "))
+        speed_sec = float(input("   ⏱️  How many seconds per tick? (e.g., 1, or 0 for flat out): "))
+        buffered = input(f"   🧺 Buffer writes into batches of {BATCH_SIZE}? (y/N): ").strip().upper() == "Y"
+    except ValueError:
+        print("❌ Invalid Number")
+        time.sleep(1)
+        return
 
+    writer = BufferedUsageWriter() if buffered else None
+    try:
         print(f"\n✅ STARTING SIMULATION: Burning {kg_per_tick}kg every {speed_sec} seconds.")
         print("🔴 PRESS 'CTRL + C' TO STOP THE DRAIN...\n")
         time.sleep(1)
 
         counter = 1
         while True:
-            success = log_usage_to_db("Continuous Production", kg_per_tick, silent=True)
-            if success:
+            if writer:
+                writer.add("Continuous Production", kg_per_tick)
+                # Redrawing every tick would cost more than the insert itself
+                if counter % 1000 == 0 or speed_sec >= 0.1:
+                    sys.stdout.write(f"\r[{counter}] 🔥 Queued... {writer.rows_written} written "
+                                     f"({writer.rows_per_second():.0f} rows/s) ")
+                    sys.stdout.flush()
+                counter += 1
+            elif log_usage_to_db("Continuous Production", kg_per_tick, silent=True):
                 # Cool Visual Feedback
                 sys.stdout.write(f"\r[{counter}] 🔥 Burned {kg_per_tick}kg... Stock Dropping... ")
                 sys.stdout.flush()
                 counter += 1
-            time.sleep(speed_sec)
+            if speed_sec > 0:
+                time.sleep(speed_sec)
 
     except KeyboardInterrupt:
+        if writer:
+            writer.close()  # Final flush: nothing queued is lost
+            print(f"\n\n📊 {writer.rows_written} rows written, {writer.rows_failed} failed, "
+                  f"{writer.rows_per_second():.0f} rows/s")
         print("\n\n🛑 SIMULATION STOPPED. Returning to menu...")
         time.sleep(2)
 
 
+# ==========================================
+# 2. HEADLESS LOAD TEST (no menu)
+# N production lines write usage concurrently (one thread each, Poisson
+# arrivals at their own rate and product mix) while API readers hit the
+# endpoints, then throughput, errors and latency percentiles are reported.
+#
+#   python pseudo_consumer.py --headless --lines 8 --rate 20 --duration 60
+#   python pseudo_consumer.py --headless --line 50@1=3,2=1 --line 5@3=1 --buffered
+# ==========================================
+class LoadStats:
+    """Latencies (s) and error counts per operation, shared by every thread."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, ok=True):
+        with self._lock:
+            self.latencies.setdefault(operation, [])
+            self.errors.setdefault(operation, 0)
+            if ok:
+                self.latencies[operation].append(seconds)
+            else:
+                self.errors[operation] += 1
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+def parse_mix(spec):
+    """'1=3,2=1' -> {"Dark Chocolate Bar": (0.05 kg/unit, share 3), ...} (keys from MENU)."""
+    mix = {}
+    for part in spec.split(","):
+        key, _, share = part.partition("=")
+        item = MENU.get(key.strip())
+        if not item or "weight" not in item:
+            raise argparse.ArgumentTypeError(f"unknown product '{key}' (use MENU keys with a weight)")
+        mix[item["name"]] = (item["weight"], float(share or 1))
+    return mix
+
+
+def parse_line(spec):
+    """'20@1=3,2=1' -> (20 events/s, mix). A bare '20' uses --mix."""
+    rate, _, mix = spec.partition("@")
+    return float(rate), parse_mix(mix) if mix else None
+
+
+def run_production_line(number, rate, mix, units, stats, stop, writer=None):
+    """Logs usage events until `stop`: Poisson arrivals at `rate`/s (0 = flat out)."""
+    products = list(mix)
+    shares = [share for _, share in mix.values()]
+    rng = random.Random(number)
+    while not stop.is_set():
+        product = rng.choices(products, shares)[0]
+        quantity_kg = units * mix[product][0]
+        if writer:
+            writer.add(product, quantity_kg)  # Timed per batch (writer.flush_seconds)
+        else:
+            started = time.perf_counter()
+            ok = log_usage_to_db(product, quantity_kg, silent=True)
+            stats.record("write", time.perf_counter() - started, ok)
+        if rate > 0:
+            stop.wait(rng.expovariate(rate))
+
+
+def run_api_reader(operation, method, url, interval, stats, stop):
+    """Calls one endpoint back to back (or every `interval` s) until `stop`."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            # urlopen raises on 4xx/5xx; the API also reports failures as {"status": "error"}
+            with urllib.request.urlopen(urllib.request.Request(url, method=method), timeout=120) as response:
+                ok = json.load(response).get("status") != "error"
+        except Exception:
+            ok = False
+        stats.record(operation, time.perf_counter() - started, ok)
+        if interval > 0:
+            stop.wait(interval)
+
+
+def run_headless(args):
+    lines = [parse_line(spec) for spec in args.line] or [(args.rate, None)] * args.lines
+    default_mix = parse_mix(args.mix)
+    stats = LoadStats()
+    stop = threading.Event()
+    writer = BufferedUsageWriter() if args.buffered else None
+
+    threads = [
+        threading.Thread(target=run_production_line, name=f"line-{i}", daemon=True,
+                         args=(i, rate, mix or default_mix, args.units, stats, stop, writer))
+        for i, (rate, mix) in enumerate(lines)
+    ]
+    if args.api_url:
+        api = args.api_url.rstrip("/")
+        for i in range(args.readers):
+            threads.append(threading.Thread(
+                target=run_api_reader, name=f"reader-{i}", daemon=True,
+                args=("GET /suggest-orders-smart", "GET",
+                      f"{api}/suggest-orders-smart?mode={args.forecast_mode}", 0, stats, stop),
+            ))
+        if args.score_interval > 0:
+            threads.append(threading.Thread(
+                target=run_api_reader, name="scorer", daemon=True,
+                args=("POST /update-scores", "POST", f"{api}/update-scores", args.score_interval, stats, stop),
+            ))
+
+    print(f"🏭 {len(lines)} production lines, {len(threads) - len(lines)} API clients, "
+          f"{args.duration:.0f}s{' (buffered writes)' if writer else ''}. CTRL + C stops early.")
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        while time.perf_counter() - started < args.duration:
+            time.sleep(1)
+            written = writer.rows_written if writer else len(stats.latencies.get("write", []))
+            sys.stdout.write(f"\r   {time.perf_counter() - started:5.0f}s  {written:,} usage events written ")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=130)
+    if writer:
+        writer.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"\n\n📊 RESULTS ({elapsed:.1f}s)")
+    if writer:
+        print(f"   rows written: {writer.rows_written:,} ({writer.rows_written / elapsed:,.0f} rows/s), "
+              f"failed: {writer.rows_failed:,}")
+        stats.latencies["write.batch"] = writer.flush_seconds
+        stats.errors["write.batch"] = 0  # Failed batches are in rows_failed
+    print(f"   {'operation':<26} {'ok':>8} {'errors':>7} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for operation, latencies in stats.latencies.items():
+        latencies = sorted(latencies)
+        print(f"   {operation:<26} {len(latencies):>8,} {stats.errors[operation]:>7,} "
+              f"{len(latencies) / elapsed:>8.1f} " +
+              " ".join(f"{percentile(latencies, q) * 1000:>8.1f}" for q in (50, 95, 99)))
+    if sum(stats.errors.values()) or (writer and writer.rows_failed):
+        sys.exit(1)
+
+
 def main():
     while True:
         clear_screen()
@@ -140,4 +411,27 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Production usage simulator (interactive menu by default).")
+    parser.add_argument("--headless", action="store_true", help="Run the concurrent load test instead of the menu")
+    parser.add_argument("--supplier-id", help=f"Supplier the usage is booked against "
+                                              f"(default: {DEFAULT_SUPPLIER_ID}, else the first one in the DB)")
+    parser.add_argument("--lines", type=int, default=4, help="Production lines (threads), unless --line is given")
+    parser.add_argument("--rate", type=float, default=10.0, help="Usage events per second per line (0 = flat out)")
+    parser.add_argument("--mix", default="1=1,2=1,3=1", help="Product shares by MENU key, e.g. 1=3,2=1")
+    parser.add_argument("--line", action="append", default=[], metavar="RATE[@MIX]",
+                        help="One line with its own rate/mix, e.g. 50@1=3,2=1 (repeatable)")
+    parser.add_argument("--units", type=float, default=10, help="Units produced per event (kg = units x weight)")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--buffered", action="store_true", help="Batch writes (BufferedUsageWriter)")
+    parser.add_argument("--api-url", help="Also load the API, e.g. http://localhost:8000")
+    parser.add_argument("--readers", type=int, default=4, help="Concurrent GET /suggest-orders-smart clients")
+    parser.add_argument("--forecast-mode", choices=["accurate", "fast"], default="accurate")
+    parser.add_argument("--score-interval", type=float, default=5.0,
+                        help="Seconds between POST /update-scores (0 = don't)")
+    args = parser.parse_args()
+    SUPPLIER_ID = resolve_supplier_id(args.supplier_id)
+
+    if args.headless:
+        run_headless(args)
+    else:
+        main()
\ No newline at end of file
@@ -1,118 +1,444 @@
-import os
-
+import numpy as np
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-import json
+from sqlalchemy import text
 from datetime import datetime
 
-# 1. CONNECT TO DATABASE
-# Ask your friend for the 'postgres' password
-load_dotenv();
+import analytics_snapshot
+import db  # 1. CONNECT TO DATABASE (shared pool, see db.py)
+import metrics
+
+
+def _jsonb(column):
+    """
+    Some rows were written as a JSON *string* holding the object (double-encoded),
+    which is why the old loop needed json.loads. Unwrap those inside Postgres.
+    """
+    return f"(CASE WHEN jsonb_typeof({column}) = 'string' THEN ({column} #>> '{{}}')::jsonb ELSE {column} END)"
+
+
+# ---------------------------------------------------------
+# TYPED COLUMNS
+# The JSONB fields the formula uses, promoted to generated columns: Postgres
+# unpacks them once when a row is written (not on every scoring run), and
+# they can be indexed. Missing fields stay NULL; the queries below apply the defaults.
+# db_schema.sql creates them; this migrates an existing database (the ALTERs
+# rewrite both tables once, which is the backfill, so run it off-peak):
+#   python scoring_engine.py --migrate
+# ---------------------------------------------------------
+TYPED_COLUMNS_DDL = f"""
+    ALTER TABLE transactions
+        ADD COLUMN IF NOT EXISTS moldy_percent DOUBLE PRECISION GENERATED ALWAYS AS
+            (({_jsonb('quality')} -> 'cut_test_results' ->> 'moldy_percent')::float) STORED,
+        ADD COLUMN IF NOT EXISTS insect_damaged_percent DOUBLE PRECISION GENERATED ALWAYS AS
+            (({_jsonb('quality')} -> 'cut_test_results' ->> 'insect_damaged_percent')::float) STORED,
+        ADD COLUMN IF NOT EXISTS moisture_content DOUBLE PRECISION GENERATED ALWAYS AS
+            (({_jsonb('quality')} ->> 'moisture_content')::float) STORED;
+    ALTER TABLE suppliers
+        ADD COLUMN IF NOT EXISTS bearing_trees DOUBLE PRECISION GENERATED ALWAYS AS
+            (({_jsonb('description')} ->> 'bearing_trees')::float) STORED,
+        ADD COLUMN IF NOT EXISTS philgap_certified BOOLEAN GENERATED ALWAYS AS
+            (({_jsonb('eligibility')} ->> 'philgap_certified')::boolean) STORED;
+
+    -- e.g. "certified suppliers with low mold"
+    CREATE INDEX IF NOT EXISTS idx_transactions_moldy ON transactions(moldy_percent, supplier_id);
+    CREATE INDEX IF NOT EXISTS idx_suppliers_philgap ON suppliers(supplier_id) WHERE philgap_certified;
+"""
+
+# One row per delivery, with the audit fields as plain numbers.
+DELIVERY_QUERY = """
+    SELECT
+        t.transaction_id,
+        t.supplier_id,
+        t.date,
+        t.amount,
+        COALESCE(t.moldy_percent, 0) AS moldy_percent,
+        COALESCE(t.insect_damaged_percent, 0) AS insect_damaged_percent,
+        COALESCE(t.moisture_content, 7.0) AS moisture_content
+    FROM transactions t
+    JOIN suppliers s ON t.supplier_id = s.supplier_id
+"""
+
+# DELIVERY_QUERY over the analytics snapshot: its columns, and the same defaults
+DELIVERY_COLUMNS = ["transaction_id", "supplier_id", "date", "amount",
+                    "moldy_percent", "insect_damaged_percent", "moisture_content"]
+DELIVERY_DEFAULTS = {"moldy_percent": 0, "insect_damaged_percent": 0, "moisture_content": 7.0}
+
+# The snapshot's freshness check plus the newest delivery, in one statement (one view of the table)
+NEWEST_DELIVERY_QUERY = f"""
+    SELECT fingerprint.*, newest.date, newest.transaction_id
+    FROM ({analytics_snapshot.fingerprint_query("transactions")}) fingerprint
+    LEFT JOIN LATERAL (
+        SELECT date, transaction_id FROM transactions ORDER BY date DESC, transaction_id DESC LIMIT 1
+    ) newest ON true
+"""
+
+# One row per supplier: the farm profile + certification the formula needs.
+PROFILE_QUERY = """
+    SELECT
+        supplier_id,
+        reliability_score,
+        COALESCE(bearing_trees, 100) AS bearing_trees,
+        COALESCE(philgap_certified, false) AS philgap_certified
+    FROM suppliers
+"""
+
+
+def migrate_typed_columns():
+    """Adds (and backfills) the typed columns + their indexes. Safe to re-run."""
+    with db.get_engine().begin() as conn:
+        conn.execute(text(TYPED_COLUMNS_DDL))
+
+
+def score_deliveries(deliveries):
+    """
+    C. QUALITY (per delivery): start at 100 and deduct for mold, insects and moisture.
+    """
+    q_score = np.full(len(deliveries), 100)
+    q_score -= np.where(deliveries['moldy_percent'].to_numpy() > 3.0, 40, 0)
+    q_score -= np.where(deliveries['insect_damaged_percent'].to_numpy() > 2.5, 20, 0)
+    q_score -= np.where(deliveries['moisture_content'].to_numpy() > 8.0, 20, 0)
+    return np.maximum(0, q_score)
+
+
+def aggregate_deliveries(deliveries):
+    """
+    Collapses deliveries into one row per supplier:
+    last_delivery, total_delivered, quality_sum, quality_count.
+    """
+    return (
+        deliveries.assign(quality_score=score_deliveries(deliveries))
+        .groupby('supplier_id')
+        .agg(
+            last_delivery=('date', 'max'),
+            total_delivered=('amount', 'sum'),
+            quality_sum=('quality_score', 'sum'),
+            quality_count=('quality_score', 'count'),
+        )
+    )
+
+
+def compute_scores(aggregates, profiles, now=None):
+    """
+    Computes the 4 factors for every supplier at once.
+    Returns a DataFrame of (supplier_id, score).
+    """
+    now = now or datetime.now()
+    df = aggregates.join(profiles.set_index('supplier_id'), how='inner')
+
+    # A. SEASONALITY
+    days_since = (now - pd.to_datetime(df['last_delivery'])).dt.days
+    seasonality_score = np.maximum(0, 100 - (days_since * 2))
+
+    # B. VOLUME
+    expected_yield = (df['bearing_trees'] * 2.0).replace(0, 1)
+    volume_score = np.minimum(100, (df['total_delivered'] / expected_yield) * 100)
+
+    # C. QUALITY
+    avg_quality_score = (df['quality_sum'] / df['quality_count']).fillna(0)
+
+    # D. PHILGAP
+    philgap_score = np.where(df['philgap_certified'], 100, 0)
+
+    # FORMULA
+    final_score = (
+            (seasonality_score * 0.40) +
+            (volume_score * 0.30) +
+            (avg_quality_score * 0.20) +
+            (philgap_score * 0.10)
+    )
+
+    return pd.DataFrame({
+        "supplier_id": df.index,
+        "score": np.trunc(final_score.to_numpy()).astype(int)
+    })
+
+
+def write_scores(conn, scores):
+    """
+    Writes every score in ONE statement (instead of one UPDATE per supplier).
+    """
+    if scores.empty:
+        return
+    conn.execute(text("""
+        UPDATE suppliers AS s
+        SET reliability_score = v.score
+        FROM unnest(CAST(:ids AS varchar[]), CAST(:scores AS int[])) AS v(supplier_id, score)
+        WHERE s.supplier_id = v.supplier_id
+    """), {"ids": scores['supplier_id'].tolist(), "scores": scores['score'].tolist()})
 
-db_str = os.getenv('DATABASE_URL')
-if not db_str:
-    raise ValueError("DATABASE_URL environment variable is not set")
-engine = create_engine(db_str)
 
-def calculate_scores():
+# ---------------------------------------------------------
+# INCREMENTAL STATE
+# Per-supplier running totals + a high-water mark on (date, transaction_id),
+# so each run only reads the deliveries that arrived since the last one.
+# ---------------------------------------------------------
+SCORING_STATE_DDL = """
+    CREATE TABLE IF NOT EXISTS supplier_score_aggregates (
+        supplier_id VARCHAR(50) PRIMARY KEY REFERENCES suppliers(supplier_id) ON DELETE CASCADE,
+        last_delivery TIMESTAMP NOT NULL,
+        total_delivered BIGINT NOT NULL DEFAULT 0,
+        quality_sum BIGINT NOT NULL DEFAULT 0,
+        quality_count BIGINT NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS scoring_watermark (
+        id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        last_date TIMESTAMP NOT NULL,
+        last_transaction_id VARCHAR(50) NOT NULL
+    );
+"""
+
+AGGREGATES_QUERY = """
+    SELECT supplier_id, last_delivery, total_delivered, quality_sum, quality_count
+    FROM supplier_score_aggregates
+"""
+
+
+# The running totals vs. the deliveries they should cover (everything up to the
+# watermark), for reconcile_totals. A row back-dated, committed late with an
+# earlier date, deleted, detached with its partition or with a changed amount
+# makes them disagree.
+CONSISTENCY_QUERY = """
+    SELECT
+        (SELECT COALESCE(SUM(quality_count), 0) FROM supplier_score_aggregates) AS folded_count,
+        (SELECT COALESCE(SUM(total_delivered), 0) FROM supplier_score_aggregates) AS folded_kg,
+        COUNT(*) AS delivery_count,
+        COALESCE(SUM(t.amount), 0) AS delivery_kg
+    FROM transactions t
+    JOIN suppliers s ON t.supplier_id = s.supplier_id
+    WHERE t.date <= :last_date AND (t.date, t.transaction_id) <= (:last_date, :last_id)
+"""
+
+
+def reset_incremental_state(conn=None):
+    """
+    Forgets the running totals. Call this whenever transactions are
+    deleted/rewritten (e.g. by the Seeder), otherwise they would be double counted.
+    """
+    if conn is None:
+        with db.get_engine().begin() as conn:
+            return reset_incremental_state(conn)
+    conn.execute(text(SCORING_STATE_DDL))
+    conn.execute(text("TRUNCATE TABLE supplier_score_aggregates, scoring_watermark"))
+
+
+def deliveries_from_snapshot(conn):
+    """
+    Every delivery, read from the analytics snapshot when it holds exactly what's in
+    the table (a full rebuild is the one scoring read that scans all of history).
+    Returns (deliveries, (date, transaction_id) of the newest one), or None: read live.
+    """
+    if not analytics_snapshot.ENABLED:
+        return None
+    count, max_date, total, newest_date, newest_id = conn.execute(text(NEWEST_DELIVERY_QUERY)).one()
+    manifest = analytics_snapshot.load_manifest()
+    transactions = analytics_snapshot.current(
+        "transactions", analytics_snapshot.as_fingerprint(count, max_date, total), manifest
+    )
+    # Exported in the same transaction as `transactions`, so it has every supplier they reference
+    suppliers = manifest.get("suppliers")
+    if transactions is None or suppliers is None or not count:
+        metrics.inc("cacao_snapshot_reads_total", table="transactions", source="live")
+        return None
+
     try:
-        # ---------------------------------------------------------
-        # STEP 1: GET THE DATA
-        # ---------------------------------------------------------
-        query = """
-        SELECT 
-            t.supplier_id,
-            t.date,
-            t.amount,
-            t.quality,
-            s.reliability_score,       
-            s.description,        
-            s.eligibility    
-        FROM transactions t 
-        JOIN suppliers s ON t.supplier_id = s.supplier_id
-        """
-        df = pd.read_sql(query, engine)
-
-        if df.empty:
-            print("⚠️ No matching data found. Did you run the Seeder?")
-            return
-
-        # ---------------------------------------------------------
-        # STEP 2: CALCULATE THE 4 FACTORS
-        # ---------------------------------------------------------
-        supplier_scores = []
-
-        for supplier_id, group in df.groupby('supplier_id'):
-
-            # A. SEASONALITY
-            last_delivery = pd.to_datetime(group['date'].max())
-            days_since = (datetime.now() - last_delivery).days
-            seasonality_score = max(0, 100 - (days_since * 2))
-
-            # B. VOLUME
-            farm_data = group['description'].iloc[0]
-            if isinstance(farm_data, str): farm_data = json.loads(farm_data)
-            bearing_trees = farm_data.get('bearing_trees', 100)
-
-            total_delivered = group['amount'].sum()
-            expected_yield = bearing_trees * 2.0
-            if expected_yield == 0: expected_yield = 1
-
-            volume_score = min(100, (total_delivered / expected_yield) * 100)
-
-            # C. QUALITY
-            quality_scores = []
-            for audit in group['quality']:
-                if isinstance(audit, str): audit = json.loads(audit)
-                q_score = 100
-                cut_test = audit.get('cut_test_results', {})
-
-                if cut_test.get('moldy_percent', 0) > 3.0: q_score -= 40
-                if cut_test.get('insect_damaged_percent', 0) > 2.5: q_score -= 20
-                if audit.get('moisture_content', 7.0) > 8.0: q_score -= 20
-                quality_scores.append(max(0, q_score))
-
-            avg_quality_score = sum(quality_scores) / len(quality_scores) if quality_scores else 0
-
-            # D. PHILGAP
-            compliance = group['eligibility'].iloc[0]
-            if isinstance(compliance, str): compliance = json.loads(compliance)
-            philgap_score = 100 if compliance.get('philgap_certified') else 0
-
-            # FORMULA
-            final_score = (
-                    (seasonality_score * 0.40) +
-                    (volume_score * 0.30) +
-                    (avg_quality_score * 0.20) +
-                    (philgap_score * 0.10)
+        with metrics.stage("snapshot.scoring_deliveries"):
+            deliveries = analytics_snapshot.read_columns(transactions, DELIVERY_COLUMNS)
+            known = analytics_snapshot.read_columns(suppliers, ["supplier_id"])["supplier_id"]
+    except Exception as e:
+        print(f"⚠️ Analytics snapshot of transactions unreadable, using the database: {e}")
+        metrics.inc("cacao_snapshot_reads_total", table="transactions", source="live")
+        return None
+    metrics.inc("cacao_snapshot_reads_total", table="transactions", source="snapshot")
+    deliveries = deliveries[deliveries["supplier_id"].isin(known)].fillna(DELIVERY_DEFAULTS)
+    return deliveries, (newest_date, newest_id)
+
+
+def fold_new_deliveries(conn):
+    """
+    Reads only the deliveries past the watermark and adds them to the running totals.
+    Returns how many new deliveries were folded in.
+    """
+    watermark = conn.execute(text(
+        "SELECT last_date, last_transaction_id FROM scoring_watermark WHERE id = 1"
+    )).first()
+
+    query = DELIVERY_QUERY
+    params = {}
+    from_snapshot = None if watermark else deliveries_from_snapshot(conn)
+    if watermark:
+        # The plain date bound is implied by the row comparison; it lets Postgres
+        # skip old months outright when transactions is partitioned
+        query += " WHERE t.date >= :last_date AND (t.date, t.transaction_id) > (:last_date, :last_id)"
+        params = {"last_date": watermark.last_date, "last_id": watermark.last_transaction_id}
+    query += " ORDER BY t.date, t.transaction_id"
+
+    if from_snapshot:
+        new_deliveries, (newest_date, newest_id) = from_snapshot
+    else:
+        with metrics.stage("db.scoring_new_deliveries"):
+            new_deliveries = pd.read_sql(text(query), conn, params=params)
+        metrics.inc("cacao_db_rows_fetched_total", len(new_deliveries), query="scoring_new_deliveries")
+    if new_deliveries.empty:
+        return 0
+
+    batch = aggregate_deliveries(new_deliveries).reset_index()
+    # One statement for the whole batch (like write_scores), not one per supplier
+    with metrics.stage("db.scoring_fold"):
+        conn.execute(text("""
+            INSERT INTO supplier_score_aggregates AS a
+                (supplier_id, last_delivery, total_delivered, quality_sum, quality_count)
+            SELECT * FROM unnest(
+                CAST(:ids AS varchar[]), CAST(:last AS timestamp[]),
+                CAST(:total AS bigint[]), CAST(:qsum AS bigint[]), CAST(:qcount AS bigint[])
             )
+            ON CONFLICT (supplier_id) DO UPDATE SET
+                last_delivery = GREATEST(a.last_delivery, EXCLUDED.last_delivery),
+                total_delivered = a.total_delivered + EXCLUDED.total_delivered,
+                quality_sum = a.quality_sum + EXCLUDED.quality_sum,
+                quality_count = a.quality_count + EXCLUDED.quality_count
+        """), {
+            "ids": batch["supplier_id"].tolist(),
+            "last": [value.to_pydatetime() for value in batch["last_delivery"]],
+            "total": [int(value) for value in batch["total_delivered"]],
+            "qsum": [int(value) for value in batch["quality_sum"]],
+            "qcount": [int(value) for value in batch["quality_count"]],
+        })
+
+    if not from_snapshot:
+        # The query is ordered, so the last row is the new high-water mark
+        newest = new_deliveries.iloc[-1]
+        newest_date, newest_id = newest['date'].to_pydatetime(), newest['transaction_id']
+    conn.execute(text("""
+        INSERT INTO scoring_watermark (id, last_date, last_transaction_id)
+        VALUES (1, :last_date, :last_id)
+        ON CONFLICT (id) DO UPDATE SET
+            last_date = EXCLUDED.last_date,
+            last_transaction_id = EXCLUDED.last_transaction_id
+    """), {"last_date": newest_date, "last_id": newest_id})
+
+    return len(new_deliveries)
+
 
-            supplier_scores.append({
-                "supplier_id": supplier_id,
-                "score": int(final_score)
-            })
+def calculate_scores(full=False, raise_errors=False):
+    """
+    Incremental by default: only deliveries newer than the watermark are read.
+    full=True throws the running totals away and rebuilds them from all of history.
 
-        # ---------------------------------------------------------
-        # STEP 3: UPDATE THE DATABASE (The "Safe" Block)
-        # ---------------------------------------------------------
-        print(f"--- UPDATING SCORES for {len(supplier_scores)} Suppliers ---")
+    Seasonality still has to "age" every supplier each day, but that runs on the
+    aggregate table (one row per supplier), and only scores that actually
+    changed are written back.
 
+    Rows back-dated, changed or deleted behind the watermark are not picked up
+    here; reconcile_totals() (a separate job) finds and repairs that drift.
+
+    Returns {"folded", "suppliers", "updated"} (None on error, unless raise_errors).
+    """
+    summary = {"folded": 0, "suppliers": 0, "updated": 0}
+    try:
         # engine.begin() AUTOMATICALLY commits or rolls back if error
-        with engine.begin() as conn:
-            for item in supplier_scores:
-                update_query = text("""
-                    UPDATE suppliers 
-                    SET reliability_score = :score 
-                    WHERE supplier_id = :id
-                """)
-                conn.execute(update_query, {"score": item['score'], "id": item['supplier_id']})
+        with db.get_engine().begin() as conn:
+            # Two overlapping runs would fold the same rows twice
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('scoring_engine'))"))
+            conn.execute(text(SCORING_STATE_DDL))
+            if full:
+                reset_incremental_state(conn)
+
+            # ---------------------------------------------------------
+            # STEP 1: FOLD IN THE NEW DATA
+            # ---------------------------------------------------------
+            folded = summary["folded"] = fold_new_deliveries(conn)
+            print(f"--- Folded {folded} new deliveries into supplier totals ---")
+
+            with metrics.stage("db.scoring_aggregates"):
+                aggregates = pd.read_sql(text(AGGREGATES_QUERY), conn).set_index('supplier_id')
+            if aggregates.empty:
+                print("⚠️ No matching data found. Did you run the Seeder?")
+                return summary
+
+            with metrics.stage("db.scoring_profiles"):
+                profiles = pd.read_sql(text(PROFILE_QUERY), conn)
+            metrics.inc("cacao_db_rows_fetched_total", len(aggregates), query="scoring_aggregates")
+            metrics.inc("cacao_db_rows_fetched_total", len(profiles), query="scoring_profiles")
+
+            # ---------------------------------------------------------
+            # STEP 2: CALCULATE THE 4 FACTORS (all suppliers in one pass)
+            # ---------------------------------------------------------
+            with metrics.stage("scoring.compute"):
+                supplier_scores = compute_scores(aggregates, profiles)
+
+            # ---------------------------------------------------------
+            # STEP 3: UPDATE THE DATABASE (only scores that moved)
+            # ---------------------------------------------------------
+            current = profiles.set_index('supplier_id')['reliability_score']
+            changed = supplier_scores[
+                supplier_scores['score'].to_numpy() != current.reindex(supplier_scores['supplier_id']).to_numpy()
+            ]
+            print(f"--- UPDATING SCORES for {len(changed)} of {len(supplier_scores)} Suppliers ---")
+            with metrics.stage("db.scoring_write"):
+                write_scores(conn, changed)
+            summary.update(suppliers=len(supplier_scores), updated=len(changed))
 
         print("✅ Database update successful.")
+        return summary
 
     except Exception as e:
         print(f"❌ Critical Error in Scoring Engine: {e}")
+        if raise_errors:
+            raise
+
+
+def reconcile_totals(fix=False):
+    """
+    Compares the running totals with the deliveries they should cover (CONSISTENCY_QUERY).
+    It scans the whole history, so it runs as its own job (cron), not before every fold.
+    With fix=True, drifted totals are rebuilt (calculate_scores(full=True)).
+    Returns {"folded_count", "folded_kg", "actual_count", "actual_kg", "in_sync", "fixed"}.
+    """
+    with db.get_engine().connect().execution_options(isolation_level="REPEATABLE READ") as conn, conn.begin():
+        # Not halfway through someone else's fold
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('scoring_engine'))"))
+        conn.execute(text(SCORING_STATE_DDL))
+        watermark = conn.execute(text(
+            "SELECT last_date, last_transaction_id FROM scoring_watermark WHERE id = 1"
+        )).first()
+        if watermark is None:
+            row = (0, 0, 0, 0)  # Nothing folded yet: the next run reads everything anyway
+        else:
+            with metrics.stage("db.scoring_consistency"):
+                row = conn.execute(text(CONSISTENCY_QUERY), {
+                    "last_date": watermark.last_date, "last_id": watermark.last_transaction_id,
+                }).one()
+    folded_count, folded_kg, actual_count, actual_kg = (int(value) for value in row)
+    report = {
+        "folded_count": folded_count, "folded_kg": folded_kg,
+        "actual_count": actual_count, "actual_kg": actual_kg,
+        "in_sync": (folded_count, folded_kg) == (actual_count, actual_kg),
+        "fixed": False,
+    }
+    if fix and not report["in_sync"]:
+        calculate_scores(full=True, raise_errors=True)
+        report["fixed"] = True
+    return report
 
 
 if __name__ == "__main__":
-    calculate_scores()
\ No newline at end of file
+    # python scoring_engine.py [--full]   (score; --full rebuilds the running totals)
+    # python scoring_engine.py --migrate  (once, on a database older than the typed columns)
+    # python scoring_engine.py --reconcile [--fix]  (drift check, e.g. nightly from cron)
+    import sys
+    if "--migrate" in sys.argv:
+        migrate_typed_columns()
+        print("✅ Typed quality/profile columns are in place.")
+    elif "--reconcile" in sys.argv:
+        result = reconcile_totals(fix="--fix" in sys.argv)
+        print(f"   Totals: {result['folded_count']} deliveries, {result['folded_kg']}kg")
+        print(f"   Actual: {result['actual_count']} deliveries, {result['actual_kg']}kg")
+        if result["in_sync"]:
+            print("✅ Supplier totals match the deliveries.")
+        elif result["fixed"]:
+            print("✅ Supplier totals rebuilt from all of history.")
+        else:
+            print("❌ Supplier totals drifted (rows back-dated, changed or deleted). Run with --fix.")
+            sys.exit(1)
+    else:
+        calculate_scores(full="--full" in sys.argv)
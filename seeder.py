@@ -1,19 +1,19 @@
-import os
+import argparse
+import io
+import time
 
+import numpy as np
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import random
 from datetime import datetime, timedelta
 import json
-import psycopg2
+import db
+import partitions
+import scoring_engine
 
-# CONNECT TO DATABASE
-load_dotenv();
-db_str = os.getenv('DATABASE_URL')
-if not db_str:
-    raise ValueError("DATABASE_URL environment variable is not set")
-engine = create_engine(db_str)
+# CONNECT TO DATABASE (shared pool, see db.py)
+engine = db.get_engine()
 
 
 def generate_fake_data():
@@ -25,6 +25,8 @@ def generate_fake_data():
         # We use TRUNCATE for speed and cleanliness. CASCADE handles foreign keys if any.
         conn.execute(text("TRUNCATE TABLE transactions CASCADE;"))
         conn.execute(text("TRUNCATE TABLE production_logs CASCADE;"))
+        # The scoring engine's running totals describe the rows we just deleted
+        scoring_engine.reset_incremental_state(conn)
     print("✅ Old transactions and logs deleted.")
 
     # ==========================================
@@ -152,6 +154,7 @@ def generate_fake_data():
     transactions = []
     supplier_ids = [s['supplier_id'] for s in suppliers]
     start_date = datetime.now() - timedelta(days=120)  # 4 months history
+    partitions.ensure_partitions(start_date)  # No-op unless db_schema_partitioned.sql is loaded
 
     # 1. THE BIG STARTER PACK
     # We need a huge starting amount because we are going to burn through it fast.
@@ -232,10 +235,159 @@ def generate_fake_data():
 
     print("✅ DONE. Data is tuned for a 'Critical' downward trend.")
 
+# ==========================================
+# SCALED SYNTHETIC DATA (benchmarks / load tests)
+# ==========================================
+PRODUCT_TYPES = ["Dark Chocolate Bar", "Tablea Pack", "Cocoa Powder", "Continuous Production"]
+DISTRICTS = ["Calinan", "Baguio", "Paquibato", "Tugbok", "Toril", "Marilog", "Buhangin", "Talomo", "Sasa"]
+
+
+def copy_frame(raw_conn, table, df):
+    """
+    Bulk-loads a DataFrame with COPY (CSV over STDIN): far faster than INSERTs.
+    """
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    with raw_conn.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def timestamps(start_date, seconds):
+    # Pre-formatted ISO strings: to_csv formats datetime columns row by row (slow)
+    return np.datetime_as_string(np.datetime64(start_date, "s") + seconds.astype("timedelta64[s]"), unit="s")
+
+
+def generate_suppliers(rng, count):
+    idx = np.arange(count)
+    bearing_trees = rng.integers(200, 10_000, size=count)
+    certified = rng.random(count) < 0.6
+    district = np.array(DISTRICTS)[rng.integers(0, len(DISTRICTS), size=count)]
+    ids = pd.Series(idx).map("SUP-GEN-{:06d}".format)
+    return pd.DataFrame({
+        "supplier_id": ids,
+        "name": "Synthetic Cacao Farm " + ids.str[-6:],
+        "location": '{"city": "Davao City", "district": "' + pd.Series(district) + '"}',
+        "eligibility": pd.Series(np.where(certified, '{"philgap_certified": true}', '{"philgap_certified": false}')),
+        "description": '{"bearing_trees": ' + pd.Series(bearing_trees).astype(str) + '}',
+        "reliability_score": 0,
+    }), bearing_trees
+
+
+def generate_deliveries(rng, first_id, day_offsets, start_date, supplier_ids, supplier_weights):
+    """One chunk of transactions for the given days (one row per delivery)."""
+    n = len(day_offsets)
+    seconds = day_offsets * 86_400 + rng.integers(6 * 3600, 18 * 3600, size=n)
+    moldy = rng.gamma(2.0, 1.0, size=n).round(1)
+    insect = rng.gamma(1.5, 1.0, size=n).round(1)
+    moisture = rng.normal(7.2, 0.6, size=n).round(1)
+    return pd.DataFrame({
+        "transaction_id": pd.Series(np.arange(first_id, first_id + n)).map("TXN-GEN-{}".format),
+        "supplier_id": supplier_ids[rng.choice(len(supplier_ids), size=n, p=supplier_weights)],
+        "amount": rng.integers(50, 500, size=n),
+        "price": rng.uniform(110, 140, size=n).round(2),
+        "date": timestamps(start_date, seconds),
+        "quality": (
+            '{"cut_test_results": {"moldy_percent": ' + pd.Series(moldy).astype(str)
+            + ', "insect_damaged_percent": ' + pd.Series(insect).astype(str)
+            + '}, "moisture_content": ' + pd.Series(moisture).astype(str) + '}'
+        ),
+        "status": "completed",
+    })
+
+
+def generate_batches(rng, first_id, day_offsets, start_date, supplier_ids, mean_quantity):
+    """One chunk of production_logs for the given days (one row per cooking batch)."""
+    n = len(day_offsets)
+    seconds = day_offsets * 86_400 + rng.integers(7 * 3600, 20 * 3600, size=n)
+    quantity = np.maximum(1, rng.uniform(0.7, 1.3, size=n) * mean_quantity).astype(int)
+    return pd.DataFrame({
+        "log_id": pd.Series(np.arange(first_id, first_id + n)).map("LOG-GEN-{}".format),
+        "date": timestamps(start_date, seconds),
+        "product_type": np.array(PRODUCT_TYPES)[rng.integers(0, len(PRODUCT_TYPES), size=n)],
+        "quantity": quantity,
+        "supplier_id": supplier_ids[rng.integers(0, len(supplier_ids), size=n)],
+    })
+
+
+def generate_scaled_data(suppliers=1000, years=1.0, deliveries_per_day=50.0, batches_per_day=150.0,
+                         seed=42, chunk_rows=200_000):
+    """
+    Replaces ALL suppliers/transactions/production_logs with a synthetic dataset:
+    `years` of history ending today, Poisson-distributed deliveries and cooking
+    batches per day, suppliers weighted by farm size. Rows are generated
+    `chunk_rows` at a time and bulk-loaded with COPY, one commit per chunk.
+    Same `seed` => same dataset.
+    """
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    days = max(1, int(round(years * 365)))
+    start_date = pd.Timestamp(datetime.now().date()) - pd.Timedelta(days=days)
+
+    print(f"0. Wiping suppliers + history (synthetic: {suppliers} suppliers, {days} days)...")
+    with engine.begin() as conn:
+        # CASCADE also empties transactions, production_logs and scoring totals
+        conn.execute(text("TRUNCATE TABLE suppliers CASCADE;"))
+        scoring_engine.reset_incremental_state(conn)
+    # Monthly partitions for the whole range first (no-op on the plain schema)
+    partitions.ensure_partitions(start_date)
+
+    supplier_df, bearing_trees = generate_suppliers(rng, suppliers)
+    supplier_ids = supplier_df["supplier_id"].to_numpy()
+    supplier_weights = bearing_trees / bearing_trees.sum()
+    # Cook a bit less than we buy on average (~275kg per delivery), so stock drifts slowly
+    mean_quantity = 0.95 * deliveries_per_day * 275 / max(batches_per_day, 1e-9)
+
+    raw_conn = engine.raw_connection()
+    try:
+        copy_frame(raw_conn, "suppliers", supplier_df)
+        raw_conn.commit()
+        print(f"1. ✅ {suppliers} suppliers loaded.")
+
+        for table, per_day, make_chunk in [
+            ("transactions", deliveries_per_day,
+             lambda first, offs: generate_deliveries(rng, first, offs, start_date, supplier_ids, supplier_weights)),
+            ("production_logs", batches_per_day,
+             lambda first, offs: generate_batches(rng, first, offs, start_date, supplier_ids, mean_quantity)),
+        ]:
+            # Rows per day are Poisson; chunk whole days so each chunk is ~chunk_rows rows
+            counts = rng.poisson(per_day, size=days)
+            days_per_chunk = max(1, int(chunk_rows / max(per_day, 1e-9)))
+            loaded = 0
+            for first_day in range(0, days, days_per_chunk):
+                chunk_counts = counts[first_day:first_day + days_per_chunk]
+                offsets = np.repeat(np.arange(first_day, first_day + len(chunk_counts)), chunk_counts)
+                if len(offsets) == 0:
+                    continue
+                copy_frame(raw_conn, table, make_chunk(loaded, offsets))
+                raw_conn.commit()
+                loaded += len(offsets)
+                print(f"\r2. {table}: {loaded:,} rows loaded...", end="", flush=True)
+            print(f"\r2. ✅ {table}: {loaded:,} rows loaded.       ")
+    finally:
+        raw_conn.close()
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE suppliers; ANALYZE transactions; ANALYZE production_logs;"))
+    print(f"✅ DONE in {time.perf_counter() - started:.1f}s.")
+
+
 if __name__ == "__main__":
-    # Optional: wipe old data before generating new
-    # with engine.connect() as conn:
-    #     conn.execute(text("DELETE FROM transactions; DELETE FROM production_logs;"))
-    #     conn.commit()
+    parser = argparse.ArgumentParser(description="Seed the database (small demo set by default).")
+    parser.add_argument("--suppliers", type=int,
+                        help="Generate a synthetic dataset with this many suppliers instead of the demo set")
+    parser.add_argument("--years", type=float, default=1.0, help="Years of history (synthetic)")
+    parser.add_argument("--deliveries-per-day", type=float, default=50.0, help="Average deliveries per day (synthetic)")
+    parser.add_argument("--batches-per-day", type=float, default=150.0, help="Average cooking batches per day (synthetic)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (synthetic)")
+    parser.add_argument("--chunk-rows", type=int, default=200_000, help="Rows generated + COPYed per chunk (synthetic)")
+    args = parser.parse_args()
 
-    generate_fake_data()
\ No newline at end of file
+    if args.suppliers:
+        generate_scaled_data(
+            suppliers=args.suppliers, years=args.years,
+            deliveries_per_day=args.deliveries_per_day, batches_per_day=args.batches_per_day,
+            seed=args.seed, chunk_rows=args.chunk_rows,
+        )
+    else:
+        generate_fake_data()
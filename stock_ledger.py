@@ -0,0 +1,157 @@
+import sys
+
+from sqlalchemy import text
+
+import db
+import partitions
+
+# =========================================================
+# RUNNING STOCK LEDGER
+# Statement-level triggers keep SUM(amount) of transactions (kg_in) and
+# SUM(quantity) of production_logs (kg_out) up to date as rows are written,
+# so reading current stock never scans the event tables.
+#
+# The totals are spread over a few "slots" (picked by backend pid) so that
+# concurrent writers (e.g. several consumer terminals) don't all queue on one row.
+# =========================================================
+
+LEDGER_SLOTS = 16
+
+LEDGER_DDL = f"""
+    CREATE TABLE IF NOT EXISTS stock_ledger (
+        slot INT PRIMARY KEY,
+        kg_in BIGINT NOT NULL DEFAULT 0,
+        kg_out BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO stock_ledger (slot)
+    SELECT generate_series(0, {LEDGER_SLOTS - 1})
+    ON CONFLICT (slot) DO NOTHING;
+
+    -- TG_ARGV: ledger column (kg_in/kg_out), value column (amount/quantity)
+    CREATE OR REPLACE FUNCTION stock_ledger_apply() RETURNS trigger AS $$
+    DECLARE
+        delta NUMERIC := 0;
+        removed NUMERIC := 0;
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            EXECUTE format('UPDATE stock_ledger SET %I = 0', TG_ARGV[0]);
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            EXECUTE format('SELECT COALESCE(SUM(%I), 0) FROM new_rows', TG_ARGV[1]) INTO delta;
+        END IF;
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            EXECUTE format('SELECT COALESCE(SUM(%I), 0) FROM old_rows', TG_ARGV[1]) INTO removed;
+        END IF;
+        IF delta - removed <> 0 THEN
+            EXECUTE format('UPDATE stock_ledger SET %I = %I + $1 WHERE slot = $2', TG_ARGV[0], TG_ARGV[0])
+            USING delta - removed, pg_backend_pid() % {LEDGER_SLOTS};
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS stock_ledger_ins ON transactions;
+    DROP TRIGGER IF EXISTS stock_ledger_upd ON transactions;
+    DROP TRIGGER IF EXISTS stock_ledger_del ON transactions;
+    DROP TRIGGER IF EXISTS stock_ledger_trunc ON transactions;
+    CREATE TRIGGER stock_ledger_ins AFTER INSERT ON transactions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_apply('kg_in', 'amount');
+    CREATE TRIGGER stock_ledger_upd AFTER UPDATE ON transactions
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_apply('kg_in', 'amount');
+    CREATE TRIGGER stock_ledger_del AFTER DELETE ON transactions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_apply('kg_in', 'amount');
+    CREATE TRIGGER stock_ledger_trunc AFTER TRUNCATE ON transactions
+        FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_apply('kg_in', 'amount');
+
+    DROP TRIGGER IF EXISTS stock_ledger_ins ON production_logs;
+    DROP TRIGGER IF EXISTS stock_ledger_upd ON production_logs;
+    DROP TRIGGER IF EXISTS stock_ledger_del ON production_logs;
+    DROP TRIGGER IF EXISTS stock_ledger_trunc ON production_logs;
+    CREATE TRIGGER stock_ledger_ins AFTER INSERT ON production_logs
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_apply('kg_out', 'quantity');
+    CREATE TRIGGER stock_ledger_upd AFTER UPDATE ON production_logs
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_apply('kg_out', 'quantity');
+    CREATE TRIGGER stock_ledger_del AFTER DELETE ON production_logs
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_apply('kg_out', 'quantity');
+    CREATE TRIGGER stock_ledger_trunc AFTER TRUNCATE ON production_logs
+        FOR EACH STATEMENT EXECUTE FUNCTION stock_ledger_apply('kg_out', 'quantity');
+"""
+
+# O(1): reads LEDGER_SLOTS rows no matter how long the history is
+CURRENT_STOCK_QUERY = "SELECT COALESCE(SUM(kg_in) - SUM(kg_out), 0) AS current_stock_kg FROM stock_ledger"
+
+# The expensive way, only used to check the ledger. Months detached by
+# partition retention are added back from partition_archive (see partitions.py).
+FULL_SUM_QUERY = """
+    SELECT
+        (SELECT COALESCE(SUM(amount), 0) FROM transactions) AS kg_in,
+        (SELECT COALESCE(SUM(quantity), 0) FROM production_logs) AS kg_out
+"""
+
+
+def reconcile(fix=False):
+    """
+    Compares the ledger with the full-table sums. With fix=True the event tables
+    are locked against writes for a moment and the ledger is rewritten from them.
+    Returns {"ledger_in", "ledger_out", "actual_in", "actual_out", "in_sync", "fixed"}.
+    """
+    # One snapshot for both reads, so concurrent inserts can't look like drift
+    with db.get_engine().connect().execution_options(isolation_level="REPEATABLE READ") as conn, conn.begin():
+        if fix:
+            # SHARE blocks writers (so no trigger runs in between) but not readers
+            conn.execute(text("LOCK TABLE transactions, production_logs IN SHARE MODE"))
+
+        ledger_in, ledger_out = conn.execute(text(
+            "SELECT COALESCE(SUM(kg_in), 0), COALESCE(SUM(kg_out), 0) FROM stock_ledger"
+        )).one()
+        actual_in, actual_out = conn.execute(text(FULL_SUM_QUERY)).one()
+        archived = partitions.archived_totals(conn)
+        actual_in += archived["transactions"]
+        actual_out += archived["production_logs"]
+        report = {
+            "ledger_in": int(ledger_in), "ledger_out": int(ledger_out),
+            "actual_in": int(actual_in), "actual_out": int(actual_out),
+            "in_sync": (ledger_in, ledger_out) == (actual_in, actual_out),
+            "fixed": False,
+        }
+
+        if fix and not report["in_sync"]:
+            conn.execute(text("UPDATE stock_ledger SET kg_in = 0, kg_out = 0"))
+            conn.execute(text("UPDATE stock_ledger SET kg_in = :kg_in, kg_out = :kg_out WHERE slot = 0"),
+                         {"kg_in": actual_in, "kg_out": actual_out})
+            report["fixed"] = True
+    return report
+
+
+def install():
+    """Creates the ledger + triggers (idempotent) and seeds it from the current tables."""
+    with db.get_engine().begin() as conn:
+        conn.execute(text(LEDGER_DDL))
+    return reconcile(fix=True)
+
+
+if __name__ == "__main__":
+    # python stock_ledger.py --install      (first time on an existing database)
+    # python stock_ledger.py [--fix]        (reconciliation job, e.g. from cron)
+    if "--install" in sys.argv:
+        result = install()
+        print("✅ Stock ledger installed and seeded from the event tables.")
+    else:
+        result = reconcile(fix="--fix" in sys.argv)
+
+    print(f"   Ledger: in={result['ledger_in']}kg out={result['ledger_out']}kg")
+    print(f"   Actual: in={result['actual_in']}kg out={result['actual_out']}kg")
+    if result["in_sync"]:
+        print("✅ Ledger matches the full sums.")
+    elif result["fixed"]:
+        print("✅ Ledger rewritten from the full sums.")
+    else:
+        print("❌ Ledger drifted from the full sums. Run with --fix.")
+        sys.exit(1)
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+import metrics
+
+# =========================================================
+# STOCK-OUT RISK (Monte Carlo)
+# Instead of one point estimate (stock + inflow - outflow), simulate thousands
+# of possible next-N-days and count how often the warehouse runs dry.
+# - outflow: the outflow forecast per day + historical day-to-day noise, drawn
+#   as whole weeks of residuals (keeps the runs of busy/quiet days together)
+# - inflow: deliveries are lumpy (nothing for days, then a few hundred kg), so
+#   each day gets a Poisson number of deliveries (rate from the supply forecast)
+#   with sizes drawn from real past deliveries
+# Every scenario is simulated at once as one (scenarios x days) array.
+# =========================================================
+
+# How much history the noise and delivery sizes are drawn from
+HISTORY_DAYS = int(os.getenv('RISK_HISTORY_DAYS', '365'))
+# Seconds the history above is reused before it's read again
+HISTORY_MAX_AGE = float(os.getenv('RISK_HISTORY_MAX_AGE', '300'))
+# Residuals are resampled in blocks of this many consecutive days
+BLOCK_DAYS = 7
+# Delivery sizes are pre-drawn into a pool this big (see delivery_pool)
+POOL_SIZE = 1 << 16
+# Above this many deliveries a day, rng.poisson is faster than poisson_counts' table
+MAX_TABLE_RATE = 10
+
+DELIVERY_SIZES_QUERY = """
+    SELECT amount FROM transactions
+    WHERE date >= now() - make_interval(days => :days) AND amount > 0
+"""
+
+DAILY_OUTFLOW_QUERY = """
+    WITH daily AS (
+        SELECT date_trunc('day', date) AS ds, SUM(quantity) AS y
+        FROM production_logs
+        WHERE date >= date_trunc('day', now()) - make_interval(days => :days)
+        GROUP BY 1
+    )
+    SELECT COALESCE(daily.y, 0)
+    FROM generate_series(
+        date_trunc('day', now()) - make_interval(days => :days), date_trunc('day', now()) - interval '1 day',
+        interval '1 day'
+    ) AS days(ds)
+    LEFT JOIN daily ON daily.ds = days.ds
+    ORDER BY days.ds
+"""
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def outflow_residuals(y):
+    """
+    What a weekly-seasonal level doesn't explain: each day minus its centered 7-day
+    mean and its weekday's usual offset. These are the day-to-day surprises the
+    forecast (which already has the level and the weekly pattern) can't predict.
+    """
+    y = np.asarray(y, dtype=float)
+    if len(y) < 2 * BLOCK_DAYS:
+        return np.zeros(BLOCK_DAYS)
+    level = np.convolve(y, np.ones(7) / 7, mode="valid")  # Centered on y[3:-3]
+    detrended = y[3:-3] - level
+    weekday = np.arange(len(detrended)) % 7
+    offsets = np.bincount(weekday, weights=detrended, minlength=7) / np.bincount(weekday, minlength=7)
+    return detrended - offsets[weekday]
+
+
+def delivery_pool(sizes, seed=None):
+    """
+    Running total over POOL_SIZE past delivery sizes drawn at random. The sum of k
+    random deliveries is then pool[o + k] - pool[o] for a random offset o: one draw
+    per (scenario, day) instead of one per delivery, and the pool stays in CPU cache.
+    """
+    if not len(sizes):
+        return None
+    draws = np.random.default_rng(seed).choice(sizes, size=POOL_SIZE)
+    return np.concatenate(([0.0], np.cumsum(draws)))
+
+
+def load_history(engine, days=HISTORY_DAYS):
+    """
+    {"delivery_sizes", "delivery_pool", "outflow_residuals"} for the last `days` days, reused for
+    HISTORY_MAX_AGE seconds (it barely moves between requests, the simulation is the hot path).
+    """
+    global _history
+    with _history_lock:
+        if _history and _history["days"] == days and time.monotonic() - _history["loaded_at"] < HISTORY_MAX_AGE:
+            return _history
+
+        with metrics.stage("db.risk_history"), engine.connect() as conn:
+            sizes = np.fromiter(
+                (row[0] for row in conn.execute(text(DELIVERY_SIZES_QUERY), {"days": days})), dtype=float
+            )
+            outflow = np.fromiter(
+                (row[0] for row in conn.execute(text(DAILY_OUTFLOW_QUERY), {"days": days})), dtype=float
+            )
+        metrics.inc("cacao_db_rows_fetched_total", len(sizes), query="risk_delivery_sizes")
+        metrics.inc("cacao_db_rows_fetched_total", len(outflow), query="risk_daily_outflow")
+
+        _history = {
+            "days": days,
+            "loaded_at": time.monotonic(),
+            "delivery_sizes": sizes,
+            "delivery_pool": delivery_pool(sizes),
+            "outflow_residuals": outflow_residuals(outflow),
+        }
+        return _history
+
+
+def poisson_counts(rates, scenarios, rng):
+    """
+    Poisson(rates[day]) for every (scenario, day). At a few deliveries a day, one
+    float32 uniform compared against each day's running cumulative probability is
+    about twice as fast as rng.poisson (which loops per draw at small rates).
+    """
+    if rates.max() > MAX_TABLE_RATE:
+        return rng.poisson(rates, size=(scenarios, len(rates)))
+    u = rng.random((scenarios, len(rates)), dtype=np.float32)
+    counts = np.zeros(u.shape, dtype=np.int32)
+    pmf = np.exp(-rates)
+    cdf = pmf.copy()
+    k = 0
+    # Stops once every day's P(count <= k) rounds to 1 in float32 (u never reaches 1)
+    while (cdf32 := cdf.astype(np.float32)).min() < 1:
+        counts += u > cdf32
+        k += 1
+        pmf = pmf * rates / k
+        cdf += pmf
+    return counts
+
+
+def simulate_stock(stock_kg, inflow_daily, outflow_daily, history, scenarios=10_000, seed=None):
+    """
+    End-of-day stock for every scenario: a (scenarios x days) array.
+    inflow_daily / outflow_daily are the per-day forecasts (kg); the same seed gives the same scenarios.
+    """
+    rng = np.random.default_rng(seed)
+    outflow_mean = np.maximum(np.asarray(outflow_daily, dtype=float), 0)
+    inflow_mean = np.maximum(np.asarray(inflow_daily, dtype=float), 0)
+    days = len(outflow_mean)
+
+    # Outflow: forecast + whole weeks of past residuals, never below zero
+    residuals = history["outflow_residuals"]
+    blocks = -(-days // BLOCK_DAYS)
+    starts = rng.integers(0, len(residuals) - BLOCK_DAYS + 1, size=(scenarios, blocks))
+    noise = residuals[(starts[:, :, None] + np.arange(BLOCK_DAYS)).reshape(scenarios, -1)[:, :days]]
+    outflow = np.maximum(outflow_mean + noise, 0)
+
+    # Inflow: Poisson deliveries per day, each one a real past delivery size
+    sizes, pool = history["delivery_sizes"], history["delivery_pool"]
+    if len(sizes):
+        counts = poisson_counts(inflow_mean / sizes.mean(), scenarios, rng)
+        offsets = rng.integers(0, len(pool) - counts.max(), size=(scenarios, days))
+        inflow = pool[offsets + counts] - pool[offsets]
+    else:
+        inflow = np.broadcast_to(inflow_mean, (scenarios, days))  # No deliveries on record: expected value
+
+    return stock_kg + np.cumsum(inflow - outflow, axis=1)
+
+
+def summarize(stock, service_level=0.95, min_stock_kg=0, lead_time_days=0):
+    """
+    - stockout_probability_by_day: share of scenarios below min_stock_kg at the end of each day
+    - stockout_probability: share that drop below it at least once over the horizon
+    - required_order_kg: smallest order which, arriving after lead_time_days, keeps
+      `service_level` of the scenarios at or above min_stock_kg from then on
+    """
+    below = stock < min_stock_kg
+    # Arrives at the start of day lead_time_days, so only the days from then on can be saved
+    shortfall = min_stock_kg - stock[:, lead_time_days:].min(axis=1)
+    return {
+        "stockout_probability_by_day": below.mean(axis=0).round(4).tolist(),
+        "stockout_probability": round(float(below.any(axis=1).mean()), 4),
+        "end_stock_kg": dict(zip(("p5", "p50", "p95"), (int(q) for q in np.percentile(stock[:, -1], [5, 50, 95])))),
+        "required_order_kg": int(np.ceil(max(0.0, np.quantile(shortfall, service_level)))),
+    }
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import sys
+import time
+from bisect import bisect_left
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+import db
+import metrics
+
+# =========================================================
+# RANKED SUPPLIER CACHE
+# Scores only change when something writes to `suppliers` (in practice: a
+# scoring run). A statement trigger bumps supplier_generation on every such
+# write, so each API process keeps the ranking in memory and only reloads it
+# when the generation moved. The generation doubles as the leaderboard's ETag.
+#
+# Install once, after loading db_schema.sql (safe to re-run):
+#   python supplier_cache.py --install
+# =========================================================
+GENERATION_DDL = """
+    CREATE TABLE IF NOT EXISTS supplier_generation (
+        id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        generation BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO supplier_generation (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+    CREATE OR REPLACE FUNCTION supplier_generation_bump() RETURNS trigger AS $$
+    BEGIN
+        UPDATE supplier_generation SET generation = generation + 1 WHERE id = 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS supplier_generation_bump ON suppliers;
+    DROP TRIGGER IF EXISTS supplier_generation_bump_trunc ON suppliers;
+    CREATE TRIGGER supplier_generation_bump AFTER INSERT OR UPDATE OR DELETE ON suppliers
+        FOR EACH STATEMENT EXECUTE FUNCTION supplier_generation_bump();
+    CREATE TRIGGER supplier_generation_bump_trunc AFTER TRUNCATE ON suppliers
+        FOR EACH STATEMENT EXECUTE FUNCTION supplier_generation_bump();
+"""
+
+GENERATION_QUERY = "SELECT generation FROM supplier_generation WHERE id = 1"
+
+# Only the compact columns are cached; the JSONB blobs are always read from the DB
+CACHED_COLUMNS = ("supplier_id", "name", "location", "reliability_score")
+
+# How long (s) a generation read is trusted before asking the DB again. Scoring
+# runs in this process invalidate immediately; other workers' runs show up within this.
+CHECK_INTERVAL = float(os.getenv('SUPPLIER_CACHE_CHECK_INTERVAL', '2'))
+# Only the best MAX_ROWS suppliers are held; deeper pages come from the DB
+MAX_ROWS = int(os.getenv('SUPPLIER_CACHE_MAX_ROWS', '100000'))
+
+
+class SupplierCache:
+    """
+    The ranking as one list sorted ascending by (reliability_score, supplier_id),
+    so the best supplier is last: top-k is a slice off the end (O(k)) and a
+    keyset page is a bisect plus a slice (O(log n + k)).
+    """
+
+    def __init__(self, async_engine, check_interval=CHECK_INTERVAL, max_rows=MAX_ROWS):
+        self.async_engine = async_engine
+        self.check_interval = check_interval
+        self.max_rows = max_rows
+        self.generation = None
+        self._rows = []
+        self._keys = []
+        self._truncated = False
+        self._checked_at = float("-inf")
+        self._reload_lock = asyncio.Lock()
+        self._enabled = True
+
+    def invalidate(self):
+        """Re-check the generation on the next read (call after a scoring commit)."""
+        self._checked_at = float("-inf")
+
+    async def refresh(self):
+        """
+        Makes sure the cached ranking matches the current generation.
+        Returns the generation, or None when the generation table isn't installed
+        (then nothing is cached and callers go to the DB).
+        """
+        if not self._enabled:
+            return None
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self.generation
+
+        async with self._reload_lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return self.generation  # Someone else just checked
+            try:
+                async with self.async_engine.connect() as conn:
+                    generation = (await conn.execute(text(GENERATION_QUERY))).scalar()
+                    if generation != self.generation:
+                        await self._load(conn)
+            except ProgrammingError:
+                print("⚠️ supplier_generation is missing (run python supplier_cache.py --install); "
+                      "supplier lists will not be cached.")
+                self._enabled = False
+                return None
+            self.generation = generation
+            self._checked_at = time.monotonic()
+        return self.generation
+
+    async def _load(self, conn):
+        with metrics.stage("db.supplier_cache_load"):
+            result = await conn.execute(text(f"""
+                SELECT {', '.join(CACHED_COLUMNS)} FROM suppliers
+                WHERE reliability_score IS NOT NULL
+                ORDER BY reliability_score DESC, supplier_id COLLATE "C" DESC
+                LIMIT :limit
+            """), {"limit": self.max_rows + 1})
+            rows = [dict(row) for row in result.mappings()]
+        metrics.inc("cacao_db_rows_fetched_total", len(rows), query="supplier_cache_load")
+
+        self._truncated = len(rows) > self.max_rows
+        rows = rows[:self.max_rows]
+        rows.reverse()
+        self._rows = rows
+        self._keys = [(row["reliability_score"], row["supplier_id"]) for row in rows]
+
+    def top(self, k):
+        """Best k suppliers, best first. Call refresh() first."""
+        return self._rows[:-k - 1:-1] if k else []
+
+    def page(self, after, limit):
+        """
+        Keyset page: the `limit` best suppliers ranked below `after` ((score, supplier_id)
+        or None for the first page), best first. Returns (rows, has_more), or None
+        when the page reaches past the cached rows (ask the DB instead).
+        """
+        end = bisect_left(self._keys, after) if after else len(self._keys)
+        start = end - limit
+        if start < 0 and self._truncated:
+            return None
+        rows = self._rows[max(0, start):end]
+        rows.reverse()
+        return rows, start > 0 or (self._truncated and start == 0)
+
+
+def install():
+    """Creates the generation table + trigger (idempotent)."""
+    with db.get_engine().begin() as conn:
+        conn.execute(text(GENERATION_DDL))
+
+
+if __name__ == "__main__":
+    if "--install" in sys.argv:
+        install()
+        print("✅ Supplier generation counter installed.")
@@ -1,7 +1,7 @@
 import requests
 
 # 1. Define the URL for the "Update Scores" button
-url = "http://localhost:8000/update-scores"
+url = "http://localhost:8000/update-scores?wait=60"  # Wait for the job instead of just queueing it
 
 print("🔘 Pushing the 'Update Scores' button...")
 